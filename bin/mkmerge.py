@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------
+#  File:        mkmerge.py
+#  Description: merge many small ntuples into a few large ones. Files whose
+#               trees have the same variables are merged by copying their
+#               compressed baskets (TFileMerger fast mode). Otherwise, the
+#               variables common to all files are copied using itreestream
+#               and otreestream. Output files are written concurrently.
+#  Created:     18-Oct-2026
+# ----------------------------------------------------------------------------
+import os, sys, re
+from multiprocessing import Pool
+try:
+    import ROOT
+except:
+    sys.exit("\n** Please setup ROOT, then try again!\n")
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'tnm'))
+from tnm import NUMPYTYPES
+# ----------------------------------------------------------------------------
+def usage():
+    sys.exit('''
+    Usage:
+      mkmerge.py [options] <output-filename> <ntuple-filename>...
+
+    A file name of the form @<filename> is a file of ntuple file names,
+    one per line. If more than one output file is needed, the files are
+    named <name>.root, <name>_0001.root, <name>_0002.root, etc.
+
+    Options:
+      -t <tree-name>   name of tree [first tree in first file]
+      -s <Mbytes>      approximate size of each output file [2000]
+      -n <count>       number of input files per output file [by size]
+      -j <jobs>        number of output files written concurrently [4]
+    ''')
+# ----------------------------------------------------------------------------
+# leaf types that otreestream.column writes back with the same type, given
+# an array of the NumPy type NUMPYTYPES[type]
+WRITABLE = ['Double_t', 'Float_t', 'Long64_t', 'Long_t', 'ULong64_t',
+            'ULong_t', 'Int_t', 'UInt_t', 'Short_t', 'UShort_t', 'UChar_t',
+            'Bool_t']
+
+BATCHSIZE = 10000
+# ----------------------------------------------------------------------------
+def getfilenames(args):
+    filenames = []
+    for arg in args:
+        if arg[0] == '@':
+            records = [x.strip() for x in open(arg[1:]).readlines()]
+            filenames += [x for x in records if x != '' and x[0] != '#']
+        else:
+            filenames.append(arg)
+    return filenames
+
+def gettree(filename, treename):
+    hfile = ROOT.TFile.Open(filename)
+    if not hfile or not hfile.IsOpen():
+        raise RuntimeError("unable to open file %s" % filename)
+    if treename == '':
+        for key in hfile.GetListOfKeys():
+            if key.ReadObj().InheritsFrom('TTree'):
+                treename = key.GetName()
+                break
+    tree = hfile.Get(treename)
+    if not tree:
+        raise RuntimeError("tree %s not found in file %s" % \
+                               (treename, filename))
+    return (hfile, tree, treename)
+
+def getschema(tree):
+    # return description of each variable:
+    #   name: (type, maximum count, leaf counter, count per entry)
+    # where count per entry is the number of values per leaf counter unit,
+    # or the fixed number of values if there is no leaf counter.
+    schema = {}
+    for leaf in tree.GetListOfLeaves():
+        branch = leaf.GetBranch()
+        if branch.GetListOfLeaves().GetEntries() == 1:
+            name = branch.GetName()
+        else:
+            name = '%s.%s' % (branch.GetName(), leaf.GetName())
+        counter = leaf.GetLeafCount()
+        if counter:
+            schema[name] = (leaf.GetTypeName(),
+                            counter.GetMaximum() * leaf.GetLenStatic(),
+                            counter.GetName(),
+                            leaf.GetLenStatic())
+        else:
+            schema[name] = (leaf.GetTypeName(), leaf.GetLen(), '',
+                            leaf.GetLen())
+    return schema
+
+def layout(schema):
+    # the layout of the variables, without the maximum counts, which vary
+    # from file to file
+    return dict([(name, (x[0], x[2], x[3])) for name, x in schema.items()])
+# ----------------------------------------------------------------------------
+# partition input files into groups, one per output file
+def partition(filenames, mbytes, nfiles):
+    groups = [[]]
+    size = 0
+    for filename in filenames:
+        fsize = os.path.getsize(filename) if os.path.exists(filename) else 0
+        if len(groups[-1]) > 0:
+            if nfiles > 0:
+                full = len(groups[-1]) >= nfiles
+            else:
+                full = size + fsize > mbytes * 1000000
+            if full:
+                groups.append([])
+                size = 0
+        groups[-1].append(filename)
+        size += fsize
+    return groups
+
+def outputname(filename, index, count):
+    if count < 2 or index == 0: return filename
+    stem = re.sub('[.]root$', '', filename)
+    return '%s_%4.4d.root' % (stem, index)
+# ----------------------------------------------------------------------------
+# copy compressed baskets
+def fastmerge(output, filenames):
+    merger = ROOT.TFileMerger(False, False)
+    merger.SetFastMethod(True)
+    if not merger.OutputFile(output, 'RECREATE'):
+        return False
+    for filename in filenames:
+        if not merger.AddFile(filename, False):
+            return False
+    return merger.Merge()
+
+# copy variables common to all files using treestream column I/O
+def slowmerge(output, filenames, treename, schemas):
+    import numpy as np
+    try:
+        import treestream
+    except:
+        try:
+            import PhysicsTools.TheNtupleMaker.AutoLoader
+        except:
+            raise RuntimeError("unable to import treestream")
+
+    # find variables common to all files
+    names = set(schemas[0].keys())
+    for schema in schemas[1:]:
+        names &= set(schema.keys())
+    counters = set([schemas[0][x][2] for x in names]) - set([''])
+
+    # the type and shape of each variable must be the same in all files
+    # and be one that otreestream can write. Leaf counters come first, so
+    # that they are created with their own type.
+    variables = []
+    for name in sorted(names, key=lambda x: (not x in counters, x)):
+        types = set([schema[name][0] for schema in schemas])
+        if len(types) > 1:
+            raise RuntimeError("variable %s has types %s" % \
+                                   (name, ', '.join(sorted(types))))
+        tname = list(types)[0]
+        if not tname in WRITABLE:
+            raise RuntimeError("type %s of variable %s not handled" % \
+                                   (tname, name))
+        maxsize = max([schema[name][1] for schema in schemas])
+        counter, count = schemas[0][name][2:]
+        if counter and count != 1:
+            raise RuntimeError("array of arrays %s not handled" % name)
+        if counter and not counter in names:
+            raise RuntimeError("leaf counter %s of %s not in all files" % \
+                                   (counter, name))
+        variables.append((name, NUMPYTYPES[tname], max(maxsize, 1),
+                          counter))
+    dropped = set.union(*[set(x.keys()) for x in schemas]) - names
+    for name in sorted(dropped):
+        print("\t** %s: variable %s not in all files; dropped" %
+              (output, name))
+
+    ostream = ROOT.otreestream(output, treename, treename)
+    arrays  = {}
+    for name, dtype, maxsize, counter in variables:
+        values  = np.zeros(BATCHSIZE * maxsize, dtype=dtype)
+        offsets = np.zeros(BATCHSIZE + 1, dtype='int32') if counter else None
+        arrays[name] = (values, offsets)
+        if counter:
+            ostream.column('%s[%s]' % (name, counter), values, maxsize,
+                           offsets)
+        elif maxsize > 1:
+            # fixed length array
+            ostream.column('%s[%d]' % (name, maxsize), values, maxsize)
+        else:
+            ostream.column(name, values)
+
+    for filename in filenames:
+        istream = ROOT.itreestream(filename, treename)
+        for name, dtype, maxsize, counter in variables:
+            values, offsets = arrays[name]
+            if counter:
+                istream.column(name, values, len(values), offsets)
+            else:
+                istream.column(name, values, len(values))
+        start   = 0
+        entries = istream.entries()
+        while start < entries:
+            count = istream.readcolumns(start, min(BATCHSIZE, entries-start))
+            if count < 1:
+                raise RuntimeError("unable to read %s" % filename)
+            ostream.writecolumns(count)
+            start += count
+        istream.close()
+    ostream.close()
+    return True
+# ----------------------------------------------------------------------------
+# errors are returned, rather than raised, so that a failed job does not
+# stop the pool
+def merge(job):
+    output = job[0]
+    try:
+        return _merge(*job)
+    except Exception as e:
+        return (False, "\t** %s: %s" % (output, e))
+
+def _merge(output, filenames, treename):
+    schemas = []
+    for filename in filenames:
+        hfile, tree, treename = gettree(filename, treename)
+        schemas.append(getschema(tree))
+        hfile.Close()
+
+    same = True
+    for schema in schemas[1:]:
+        if layout(schema) != layout(schemas[0]):
+            same = False
+            break
+    if same:
+        ok = fastmerge(output, filenames)
+        method = 'baskets copied'
+    else:
+        ok = slowmerge(output, filenames, treename, schemas)
+        method = 'variables copied'
+    if not ok:
+        return (False, "\t** unable to write %s" % output)
+    return (True, "\t%s: %d files (%s)" % (output, len(filenames), method))
+# ----------------------------------------------------------------------------
+def main():
+    argv = sys.argv[1:]
+    treename = ''
+    mbytes   = 2000
+    nfiles   = 0
+    njobs    = 4
+    args = []
+    while len(argv) > 0:
+        arg = argv.pop(0)
+        if   arg == '-t' and len(argv) > 0: treename = argv.pop(0)
+        elif arg == '-s' and len(argv) > 0: mbytes = int(argv.pop(0))
+        elif arg == '-n' and len(argv) > 0: nfiles = int(argv.pop(0))
+        elif arg == '-j' and len(argv) > 0: njobs  = int(argv.pop(0))
+        elif arg[0] == '-':
+            usage()
+        else:
+            args.append(arg)
+    if len(args) < 2: usage()
+
+    output    = args[0]
+    filenames = getfilenames(args[1:])
+    if len(filenames) == 0: usage()
+
+    # get tree name from first file if not given
+    if treename == '':
+        try:
+            hfile, tree, treename = gettree(filenames[0], treename)
+        except RuntimeError as e:
+            sys.exit("\t** %s" % e)
+        hfile.Close()
+
+    groups = partition(filenames, mbytes, nfiles)
+    jobs   = [(outputname(output, i, len(groups)), x, treename)
+              for i, x in enumerate(groups)]
+    print("\tmerging %d files into %d files" % (len(filenames), len(jobs)))
+
+    if njobs > 1 and len(jobs) > 1:
+        pool = Pool(min(njobs, len(jobs)))
+        results = pool.map(merge, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [merge(x) for x in jobs]
+    failed = 0
+    for ok, message in results:
+        print(message)
+        if not ok: failed += 1
+    if failed > 0:
+        sys.exit("\t** %d of %d output files not written" % \
+                     (failed, len(jobs)))
+# ----------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
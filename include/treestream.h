@@ -50,6 +50,21 @@
 //          23-Sep-2018 split into itreestream.h and otreestream.h
 //          25-Sep-2018 HBP - go back to a single header to avoid problems
 //                      with mkanalyzer.py
+//          18-Oct-2026 Add ptreestream to run event loops in parallel
+//          18-Oct-2026 Count entries lazily, optionally from an index file
+//          18-Oct-2026 Cache tree schema on disk (see SCHEMAtreestream)
+//          18-Oct-2026 Add readahead
+//          18-Oct-2026 Add lists of entries to be visited by next
+//          18-Oct-2026 Add eager and load to defer reading variables
+//          18-Oct-2026 Add otreestream::column and writecolumns
+//          18-Oct-2026 otreestream::store follows a precompiled plan
+//          18-Oct-2026 Add otreestream::background
+//          18-Oct-2026 Add otreestream::compression, basketsize and optimize
+//          18-Oct-2026 Add otreestream::rollover
+//          18-Oct-2026 Add otreestream skim constructor
+//          18-Oct-2026 Return arrays of arrays in a flat vector<T>
+//          18-Oct-2026 Add jagged arrays for select and add
+//          18-Oct-2026 Add trace
 //----------------------------------------------------------------------------
 #include <vector>
 #include <string>
@@ -59,6 +74,7 @@
 #include <iostream>
 #include <typeinfo>
 #include <cctype>
+#include <functional>
 
 #include "TFile.h"
 #include "TTree.h"
@@ -72,6 +88,7 @@ struct Field
   Field() 
   : srctype(' '),
     iotype(' '),
+    leaftype(0),
     isvector(0),
     iscounter(false),
     skip(false),
@@ -84,14 +101,18 @@ struct Field
     branchname(""),
     leafname(""),
     fullname(""),
-    countername("")
+    countername(""),
+    ncalls(0),
+    nbytes(0),
+    seconds(0)
   {}
   
   virtual ~Field() {}
   
   char   srctype;         /// Source type (type of user name/value pair)
   char   iotype;          /// Input/Output type
-  int    isvector;        /// 0 scaler, 1 vector, 2 2-d vector type
+  char   leaftype;        /// Type of leaf buffer (0 if unknown)
+  int    isvector;        /// 0 scaler, 1 vector, 2 2-d vector, 3 jagged
   bool   iscounter;       /// true if this is a leaf counter
   bool   skip;            /// true: do not read data
   int    maxsize;         /// Maximum number of elements in source variable
@@ -107,6 +128,10 @@ struct Field
   std::string leafname;   /// Name of T-leaf!
   std::string fullname;   /// Full name of branch/T-leaf!
   std::string countername; /// Name of leaf counter or null
+
+  int    ncalls;          /// Number of entries traced
+  double nbytes;          /// Bytes read or stored while tracing
+  double seconds;         /// Time spent reading or storing while tracing
 };
 
 template <class T>
@@ -117,6 +142,90 @@ struct FieldBuffer : public Field
   std::vector<T> value;
 };
 
+/// Model a caller-owned array bound to a name/value pair for bulk reads.
+struct Column
+{
+  Column()
+  : field(0),
+    counter(0),
+    values(0),
+    offsets(0),
+    capacity(0),
+    srctype(' '),
+    leaftype(0)
+  {}
+
+  Field* field;           /// Field bound to this column
+  Field* counter;         /// Leaf counter of field or null
+  void*  values;          /// Address of first element of caller's array
+  int*   offsets;         /// Caller's offsets array or null
+  int    capacity;        /// Number of elements caller's array can hold
+  char   srctype;         /// Type of caller's array
+  char   leaftype;        /// Type of leaf buffer (0 if unknown)
+};
+
+/// Model a step in the plan for reading the selected name/value pairs.
+struct ReadStep
+{
+  ReadStep(Field* field_=0, void (*copy_)(Field*)=0)
+  : field(field_),
+    copy(copy_)
+  {}
+
+  Field* field;           /// Field to be read
+  void (*copy)(Field*);   /// Copy to external buffer (null if none)
+};
+
+/// Model a step in the plan for storing the name/value pairs.
+struct StoreStep
+{
+  StoreStep(Field* field_=0, Field* counter_=0, 
+            int (*size_)(Field*)=0, void (*copy_)(Field*)=0)
+  : field(field_),
+    counter(counter_),
+    size(size_),
+    copy(copy_)
+  {}
+
+  Field* field;           /// Field to be stored
+  Field* counter;         /// Leaf counter of field or null
+  int  (*size)(Field*);   /// Size of external buffer (null if fixed)
+  void (*copy)(Field*);   /// Copy from external buffer
+};
+
+/** Model a jagged array: the values of many entries stored one after the
+    other in a single contiguous buffer. The values of entry <i>i</i> are 
+    values[offsets[i]],..., values[offsets[i+1]-1]. The storage is kept
+    when the array is cleared, so it can be reused from batch to batch.
+ */
+template <class T>
+struct jagged
+{
+  jagged()
+  : values(std::vector<T>()),
+    offsets(std::vector<int>(1, 0))
+  {}
+
+  /// Remove all entries, but keep the storage.
+  void clear() { values.clear(); offsets.resize(1); offsets[0] = 0; }
+
+  /// Number of entries.
+  int  size() const { return (int)offsets.size() - 1; }
+
+  /// Number of values of entry i.
+  int  count(int i) const { return offsets[i+1] - offsets[i]; }
+
+  /// Append an entry with the given values.
+  void push_back(const std::vector<T>& x)
+  {
+    values.insert(values.end(), x.begin(), x.end());
+    offsets.push_back((int)values.size());
+  }
+
+  std::vector<T>   values;  /// Values of all entries
+  std::vector<int> offsets; /// Offsets into values (size() + 1 of them)
+};
+
 typedef std::map<std::string, Field>  Data;
 typedef std::map<std::string, Field*>  SelectedData;
 
@@ -167,14 +276,28 @@ class itreestream
       The default assumption is that the file contains a single kind of tree.
       If the file contains multiple trees, you should supply the tree name.
       <p>
+      Files are opened only when needed, that is, when read crosses into 
+      a new file, or when the number of entries is first requested. The
+      latter requires opening every file unless an <i>indexfile</i>, 
+      listing the number of entries in each file, is given. If the index
+      file does not exist, it is written when the entries are first 
+      counted so that later streams can use it.
+      <p>
+      If the environment variable SCHEMAtreestream names a directory, the 
+      schema of the tree, that is, its variables, is cached there, keyed 
+      by the UUID of the first file, the tree name and the ROOT version. 
+      Later streams over the same file(s) use the cached schema instead of 
+      walking all the branches of the tree.
+      <p>
       Note: <i>filename</i> is a string of one of more filenames, each of
       which can have wildcard characters.
   */
-  itreestream(std::string filename, std::string treename="", int bufsize=1000);
+  itreestream(std::string filename, std::string treename="", int bufsize=1000,
+              std::string indexfile="");
 
   ///
   itreestream(std::vector<std::string>& filenames, std::string treename="",
-              int bufsize=1000);
+              int bufsize=1000, std::string indexfile="");
 
   ///
   virtual ~itreestream();
@@ -240,6 +363,12 @@ class itreestream
       error is failure to provide a buffer of non-zero length.
                                                                                                                                                                                                                       <br>
       <b>Note</b>: The type of the buffer need not match that of the variable.
+                                                                              <br>
+      If the variable is an array of fixed length arrays, for example
+      FatJet.Tau[5], the rows are returned one after the other in a single
+      contiguous buffer, with row <i>i</i> starting at element 5*<i>i</i>.
+      Unlike a vector of vectors, this buffer is not reallocated once it
+      is large enough.
   */
   void   select(std::string namen, std::vector<double>& data);
 
@@ -273,6 +402,11 @@ class itreestream
 
   /** Specify the name of a vector-valued array variable to be read and give the
       address of a buffer into which its values are to be written. 
+      The rows of the buffer are resized, not rebuilt, for each entry.
+      However, rows are freed when the number of rows decreases and 
+      allocated again when it increases. To avoid allocations, select
+      a vector<T>, into which the rows are written contiguously, or a
+      jagged<T>.
   */
   void   select(std::string namen, std::vector<std::vector<double> >& data);
 
@@ -291,6 +425,34 @@ class itreestream
   ///
   void   select(std::string namen, std::vector<std::vector<unsigned int> >& data);
 
+  /** Specify the name of a vector-valued variable to be read into a jagged
+      array. Each entry read appends its values to the array as a new row,
+      so that the values of many entries can be processed together. Call
+      the clear() method of the array to start a new batch.
+  */
+  void   select(std::string namen, jagged<double>& data);
+
+  ///
+  void   select(std::string namen, jagged<float>& data);
+
+  ///
+  void   select(std::string namen, jagged<long>& data);
+
+  ///
+  void   select(std::string namen, jagged<int>& data);
+
+  ///
+  void   select(std::string namen, jagged<short>& data);
+
+  ///
+  void   select(std::string namen, jagged<bool>& data);
+
+  ///
+  void   select(std::string namen, jagged<unsigned int>& data);
+
+  ///
+  void   select(std::string namen, jagged<unsigned short>& data);
+
   
   /** Read tree with ordinal value <i>entry</i>. 
       Return the ordinal value of the
@@ -299,11 +461,161 @@ class itreestream
   int    read(int entry);
 
 
+  /** Read only the given variables, and all leaf counters, in calls to
+      read. The other selected variables are read for the current entry 
+      only when load is called or, for variables selected by name only, 
+      when get or vget is called. By default, all selected variables are 
+      read. This is useful when most entries fail a cut on a few 
+      variables.
+  */
+  void   eager(std::string namen);
+
+  ///
+  void   eager(std::vector<std::string>& namen);
+
+  /// Read the given variable for the current entry, if not yet read.
+  void   load(std::string namen);
+
+  /// Read all variables for the current entry that have not yet been read.
+  void   load();
+
+  /** Visit only entries <i>start</i> to <i>stop</i>-1 in calls to next.
+      Ranges may be added repeatedly; overlapping ranges are merged.
+  */
+  void   addrange(int start, int stop);
+
+  /// Visit only the given entries in calls to next.
+  void   addentries(std::vector<int>& entries);
+
+  /// Visit only entries for which <i>bitmap[entry]</i> is true.
+  void   addbitmap(std::vector<bool>& bitmap);
+
+  /// Visit all entries in calls to next.
+  void   clearentries();
+
+  /// Return number of entries to be visited by next.
+  int    selectedentries();
+
+  /** Read the list of entries to be visited from a file of ranges,
+      one per line: <i>start</i> <i>stop</i>. The list read replaces
+      any entries already given.
+  */
+  bool   readentries(std::string filename);
+
+  /// Write the list of entries to be visited to a file.
+  bool   writeentries(std::string filename);
+
+  /** Read next entry in the list of entries, or, if no list is given, the 
+      next entry of the stream. Return its ordinal value, or -1 when there 
+      are no more entries. Since only the listed entries are read, baskets
+      that hold none of them are never read or decompressed.
+  */
+  int    next();
+
+  /// Go back to the start of the list of entries.
+  void   rewind();
+
   /** Read tree starting at <i>entry</i> start. 
       The number of rows returned is given by the size of the vector.
-      The number of vectors must match the number of branches selected.
+      The number of vectors must match the number of branches selected
+      using select(name) or select(names), taken in alphabetical order.
+      The values are read a basket at a time directly into the vectors.
   */
   void read(int start, std::vector<std::vector<double> >& v);
+
+  ///
+  void read(int start, std::vector<std::vector<float> >& v);
+
+  ///
+  void read(int start, std::vector<std::vector<long> >& v);
+
+  ///
+  void read(int start, std::vector<std::vector<int> >& v);
+
+  /** Specify the name of a variable to be read in bulk and give the 
+      address of a caller-owned array into which its values are to be 
+      written by readcolumns. The values of a simple variable, or of a 
+      fixed length array, are written contiguously one entry after another. 
+      For a variable length array, an <i>offsets</i> array of at least 
+      count+1 elements must also be given; the values of the ith entry read
+      are written to values[offsets[i]]...values[offsets[i+1]-1].
+      <p>
+      From Python, NumPy arrays can be passed directly, e.g.,
+      <pre>
+      pt = numpy.zeros(500000, dtype=numpy.float32)
+      offsets = numpy.zeros(10001, dtype=numpy.int32)
+      stream.column("Jet_pt", pt, len(pt), offsets)
+      n = stream.readcolumns(0, 10000)
+      </pre>
+      <b>Note</b>: The type of the array need not match that of the variable.
+  */
+  void   column(std::string namen, double* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, float* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, long* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, int* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, short* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, bool* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned long* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned int* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned short* values, int capacity, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned char* values, int capacity, 
+                int* offsets=0);
+
+  /** Read <i>count</i> entries, starting at entry <i>start</i>, into the 
+      arrays given in calls to column. Return the number of entries read,
+      which is smaller than count if the end of the stream is reached or if
+      the next entry would overflow one of the arrays.
+  */
+  int    readcolumns(int start, int count);
+
+  /** Read ahead. While the caller processes the current entries, ROOT
+      reads the baskets of the selected variables for the next cluster 
+      of entries in a background thread (TFile.AsyncPrefetching) into a 
+      cache of <i>cachesize</i> bytes, which is decompressed in parallel 
+      (if ROOT implicit multi-threading is enabled). The cache moves to 
+      the next file of the chain when read crosses into it. Call after 
+      select. Variables read on demand (see eager) are not cached. 
+      TFile.AsyncPrefetching is a process-wide setting; its previous 
+      value is restored when the stream is closed.
+  */
+  void   readahead(int cachesize=30000000);
+
+  /** Switch on, or off, tracing of the time spent, and the number of bytes
+      read, for each selected variable. Tracing can also be switched on by
+      setting the environment variable TRACEtreestream, in which case the 
+      trace is printed when the stream is closed.
+  */
+  void   trace(bool on=true);
+
+  /// Return the time spent, and bytes read, per variable while tracing.
+  std::string tracereport();
   
   ///
   void   close();
@@ -311,6 +623,13 @@ class itreestream
   /// Return number of entries in stream.
   int    entries();
 
+  /** Write the number of entries in each file to the given index file.
+      The index can be given to the constructor of subsequent streams
+      over the same files so that they need not open every file to count
+      entries.
+  */
+  bool   writeindex(std::string indexfile);
+
   /// Proxy for entries.
   int    size();
 
@@ -360,6 +679,8 @@ class itreestream
 
  private:
 
+  friend class otreestream;
+
   TTree*  _tree;
   TChain* _chain;
   int     _statuscode;
@@ -371,6 +692,20 @@ class itreestream
 
   Data          data;
   SelectedData  selecteddata;
+  std::vector<ReadStep> _plan;
+  bool          _replan;
+
+  std::map<std::string, int> _eager;
+  std::vector<ReadStep> _lazy;
+  std::vector<int>      _loaded;
+  std::map<std::string, int> _lazymap;
+  int     _nread;
+  int     _localentry;
+  int           _cachesize;
+
+  std::vector<std::pair<int, int> > _ranges;
+  size_t  _range;
+  int     _next;
   
   std::map<std::string, TChain*> _chainmap;
   
@@ -381,6 +716,7 @@ class itreestream
   std::vector<std::string>  branchname;
   std::vector<int>          branchtab;
   std::vector<std::string>  filepath;
+  std::vector<Column>       _columns;
 
   void _open(std::vector<std::string>& filenames, 
              std::vector<std::string>& treenames);
@@ -388,18 +724,37 @@ class itreestream
   void _getleaf    (TBranch* branch, TLeaf* leaf=0);
   void _select     (std::string name, void* address, int maxsize, 
                     char srctype, int isvector=0);
+  void _column     (std::string name, void* values, int capacity, 
+                    int* offsets, char srctype);
+  std::string _fullname(std::string name);
+  void _compile();
+  void _load(int step);
+  void _cache();
+  int  _readcolumns(std::vector<Column>& columns, int start, int count);
+  void _readrows   (int start, int nrows, std::vector<void*>& arrays, 
+                    char srctype);
   void _update();
   void _gettree(TDirectory* dir, int depth=0, std::string name="");
+  void _readindex(std::vector<Long64_t>& nentries);
+  void _bind      (Field& field);
+  bool _readschema(std::string schemafile, std::vector<std::string>& treenames,
+                   std::map<std::string, std::string>& chainnames);
+  void _writeschema(std::string schemafile);
 
   bool _delete;
+  std::string _indexfile;
   std::string _treename;
   std::vector<std::string>  _treenames;
+  bool    _trace;
+  int     _asyncprefetch;
 };
 
 std::ostream& operator<<(std::ostream& os, const itreestream& tuple);
 
 //----------------------------------------------------------------------------
 
+struct BackgroundWriter;
+
 /// Model an output stream of trees of the same species.
 class otreestream
 {
@@ -421,6 +776,23 @@ class otreestream
               int complevel=2,
               int bufsize=1000);
   
+  /** Create an output stream of trees that is a skim of the given input 
+      stream. The output tree has the variables of the input stream given
+      in <i>namen</i>, a space separated list of names that can contain
+      wildcards, together with the leaf counter of each variable length
+      array. Each call to commit, or save, writes the values of those
+      variables for the entry last read by the input stream. The selected
+      branches are read, and so decompressed, directly into the branch 
+      buffers of the output tree, rather than copied element by element,
+      and are compressed again when written; baskets are not copied. 
+      Other variables can be added as usual.
+  */
+  otreestream(std::string filename,
+              itreestream& stream,
+              std::string namen="*",
+              int complevel=2,
+              int bufsize=1000);
+
   virtual ~otreestream();
 
   ///
@@ -520,6 +892,32 @@ class otreestream
   ///
   void   add(std::string namen, std::vector<std::vector<std::string>>& data);
 
+  /** Add a variable whose values are given by the last row of a jagged 
+      array. Give the maximum number of values per entry.
+  */
+  void   add(std::string namen, jagged<double>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<float>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<long>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<int>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<short>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<bool>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<unsigned int>& data, int maxsize);
+
+  ///
+  void   add(std::string namen, jagged<unsigned short>& data, int maxsize);
+
   
   ///
   void   add(std::string namen);
@@ -527,6 +925,63 @@ class otreestream
   ///
   void   insert(std::vector<double>& data);
 
+  /** Specify the name of a variable and a caller-owned array that holds
+      its values for many entries, e.g., a NumPy array. The variables are
+      written by writecolumns. If <i>maxsize</i> > 1, the variable is of
+      variable length (see add), with at most <i>maxsize</i> values per 
+      entry. The values of entry i are at 
+      <i>values[offsets[i]]</i>...<i>values[offsets[i+1]-1]</i>, so 
+      <i>offsets</i> must have one more element than there are entries.
+      If <i>offsets</i> is not given, each entry has <i>maxsize</i> values.
+      For a fixed length array, give the length in the name, e.g.,
+      JetEt[10], with <i>maxsize</i> 10 and no offsets.
+  */
+  void   column(std::string namen, double* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, float* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, long* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, int* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, short* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, bool* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned int* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned short* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned long* values, int maxsize=1, 
+                int* offsets=0);
+
+  ///
+  void   column(std::string namen, unsigned char* values, int maxsize=1, 
+                int* offsets=0);
+
+  /** Write <i>count</i> entries from the arrays given in calls to column.
+      The values of variables given in calls to add are stored once, and 
+      are the same for all entries written. Return the number of entries 
+      written.
+  */
+  int    writecolumns(int count);
+
   /// Store values of all name/value pairs in output buffers.
   void   store();
 
@@ -536,9 +991,48 @@ class otreestream
   /// Store and save.
   void   commit();
 
+  /** Fill the tree, and therefore compress and write baskets, in a 
+      background thread so that the caller can carry on with the next 
+      entry. Each entry saved is copied to a queue of at most 
+      <i>queuesize</i> entries; save waits when the queue is full. close 
+      waits until all queued entries have been written. Call after all 
+      variables have been added. String variables are not supported, and 
+      the tree should not be used directly until the stream is closed.
+  */
+  void   background(int queuesize=100);
+
   /// Automatically save the tree header after every Mbytes written to file.
   void   autosave(int Mbytes=-1);
 
+  /** Set compression algorithm, ZLIB, LZ4, ZSTD or LZMA, and level of the
+      file and of all its branches. If <i>level</i> < 0, the level is 
+      unchanged. The default is that of ROOT, at the level given to the 
+      constructor.
+  */
+  void   compression(std::string algorithm, int level=-1);
+
+  /// Set compression algorithm and level of the given variable.
+  void   compression(std::string namen, std::string algorithm, int level=-1);
+
+  /// Set basket size, in bytes, of the given variable.
+  void   basketsize(std::string namen, int bytes);
+
+  /** Optimize the basket sizes of all branches, given the sizes of the 
+      first <i>entries</i> entries, and thereafter write clusters of
+      <i>entries</i> entries.
+  */
+  void   optimize(int entries=1000);
+
+  /** Switch on, or off, tracing of the time spent, and the number of bytes
+      stored, for each variable. Tracing can also be switched on by setting
+      the environment variable TRACEtreestream, in which case the trace is
+      printed when the stream is closed.
+  */
+  void   trace(bool on=true);
+
+  /// Return the time spent, and bytes stored, per variable while tracing.
+  std::string tracereport();
+
   ///
   void   close(bool closefile=true);
 
@@ -569,8 +1063,24 @@ class otreestream
   ///
   TTree* tree();
 
+  /** Continue writing into a new file, with the same variables, when 
+      the current file holds <i>maxentries</i> entries or, if 
+      <i>maxMbytes</i> > 0, when it exceeds maxMbytes. If the first file is
+      name.root, the following files are name_0001.root, name_0002.root,
+      etc. The stream owns, and closes, all files it opens; the tree in
+      a file given by the caller is written, but the file is not closed.
+      With a background writer, the size of the file is checked every
+      queuesize entries.
+  */
+  void   rollover(int maxentries, int maxMbytes=0);
+
+  /// Return names of files written so far.
+  std::vector<std::string> filenames();
+
  private:
 
+  friend struct BackgroundWriter;
+
   TFile* _file;
   TTree* _tree;
   int    _statuscode;
@@ -584,11 +1094,110 @@ class otreestream
 
   std::vector<std::string>      branchname;
   std::vector<int*> strsize;
+  std::vector<Column>           _columns;
+  std::vector<StoreStep>        _plan;
+  bool                          _replan;
+  BackgroundWriter*             _writer;
+
+  int       _maxentries;
+  Long64_t  _maxbytes;
+  int       _fileentries;
+  std::vector<std::string>      _filenames;
+
+  itreestream*                  _source;
+  int                           _sourcetree;
+  std::vector<TBranch*>         _sourcebranches;
+  bool                          _trace;
+  bool                          _ownfile;
 
   void _add(std::string name, void* address, int maxsize,
 	    char srctype, char iotype, int isvector=0);
+  void _compile();
+  void _column(std::string name, void* values, int maxsize, int* offsets,
+               char srctype);
+  void _fill();
+  void _rollover();
+  void _readsource();
 };
 
 std::ostream& operator<<(std::ostream& os, const otreestream& tuple);
 
+//----------------------------------------------------------------------------
+
+/** Model a parallel event loop over a list of files.
+    The files, or the entries, are partitioned among a number of workers,
+    each of which runs in its own thread and owns its own itreestream, and
+    therefore its own chain and buffers. For every worker, <i>begin</i> is 
+    called with the worker's stream and number (0, 1,...) in order to 
+    select the variables, then <i>process</i> is called for every entry, 
+    or every batch of entries, assigned to the worker. When all workers 
+    are done, <i>merge</i> is called for each worker in turn, in the 
+    calling thread, so that histograms and the like filled by the 
+    workers can be combined safely. Each worker can write its own output 
+    file, named using filename(name, worker); the files can be combined 
+    afterwards using mergefiles.
+    <p>
+    Note: begin and process are called from the worker threads, so they
+    must not modify data shared between workers.
+*/
+class ptreestream
+{
+ public:
+  /// Called once per worker: begin(stream, worker)
+  typedef std::function<void(itreestream&, int)> Begin;
+
+  /// Called after each entry is read: process(stream, entry, worker)
+  typedef std::function<void(itreestream&, int, int)> Process;
+
+  /// Called for each batch: batch(stream, start, count, worker)
+  typedef std::function<void(itreestream&, int, int, int)> Batch;
+
+  /// Called once per worker after all workers are done: merge(worker)
+  typedef std::function<void(int)> Merge;
+
+  /** Create a parallel stream of trees. If <i>nworkers</i> is zero, use
+      one worker per core. If <i>byfile</i> is true, each worker reads
+      whole files, otherwise each worker reads a contiguous range of 
+      entries of the full chain.
+  */
+  ptreestream(std::vector<std::string>& filenames, std::string treename="",
+              int nworkers=0, bool byfile=true, int bufsize=1000);
+
+  ///
+  virtual ~ptreestream();
+
+  /// Read every entry and call process for each.
+  void   run(Begin begin, Process process, Merge merge=Merge());
+
+  /// Call batch for consecutive ranges of at most batchsize entries.
+  void   runbatches(Begin begin, Batch batch, int batchsize=10000, 
+                    Merge merge=Merge());
+
+  /// Return number of workers.
+  int    size();
+
+  /// Return names of files read by given worker.
+  std::vector<std::string> filenames(int worker);
+
+  /// Return name of output file for given worker, e.g., skim_w2.root.
+  std::string filename(std::string name, int worker);
+
+  /// Merge trees and histograms in the given files into a single file.
+  static bool mergefiles(std::vector<std::string>& filenames, 
+                         std::string output);
+
+ private:
+  std::vector<std::string> _filenames;
+  std::string _treename;
+  int    _nworkers;
+  bool   _byfile;
+  int    _bufsize;
+  int    _entries;
+
+  void _run(Begin& begin, Process& process, Batch& batch, int batchsize, 
+            Merge& merge);
+  void _work(int worker, Begin& begin, Process& process, Batch& batch, 
+             int batchsize, itreestream** stream);
+};
+
 #endif
@@ -59,6 +59,31 @@
 //          23-Jun-2019 HBP allow reading of simple STL vector types from file.
 //          18-Jan-2020 HBP in ROOT 6.16/00 it seems one must store leaf counter
 //                          explicitly. 
+//          18-Oct-2026     add column/readcolumns to read ranges of entries
+//                          directly into caller-owned arrays.
+//          18-Oct-2026     read simple variables a basket at a time in
+//                          readcolumns and read(start, v).
+//          18-Oct-2026     in toexternal, copy directly from the leaf buffer
+//                          using a copy chosen when select is called.
+//          18-Oct-2026     read selected variables using a flat read plan.
+//          18-Oct-2026     add ptreestream to run event loops in parallel.
+//          18-Oct-2026     count entries only when needed, optionally
+//                          using an index of entries per file.
+//          18-Oct-2026     cache tree schema on disk.
+//          18-Oct-2026     add readahead.
+//          18-Oct-2026     add lists of entries to be visited by next.
+//          18-Oct-2026     add eager and load to defer reading variables.
+//          18-Oct-2026     add otreestream::column and writecolumns.
+//          18-Oct-2026     otreestream::store follows a precompiled plan.
+//          18-Oct-2026     add otreestream::background to fill the tree
+//                          in a background thread.
+//          18-Oct-2026     add otreestream::compression, basketsize and
+//                          optimize.
+//          18-Oct-2026     add otreestream::rollover.
+//          18-Oct-2026     add otreestream skim constructor.
+//          18-Oct-2026     reuse storage of vector<vector<T> > buffers.
+//          18-Oct-2026     add jagged arrays.
+//          18-Oct-2026     read debug level once; add trace.
 //----------------------------------------------------------------------------
 #ifdef PROJECT_NAME
 #include <boost/regex.hpp>
@@ -69,11 +94,18 @@
 #include <vector>
 #include <string>
 #include <iostream>
+#include <fstream>
 #include <sstream>
 #include <algorithm>
 #include <typeinfo>
 #include <cctype>
 #include <cassert>
+#include <cstring>
+#include <thread>
+#include <chrono>
+#include <mutex>
+#include <condition_variable>
+#include <deque>
 
 
 #include "TROOT.h"
@@ -81,6 +113,7 @@
 #include "TKey.h"
 #include "TFile.h"
 #include "TLeaf.h"
+#include "TLeafElement.h"
 #include "TDirectory.h"
 #include "TTree.h"
 #include "TClass.h"
@@ -94,6 +127,11 @@
 #include "TClassEdit.h"
 #include "TObjArray.h"
 #include "TObjString.h"
+#include "TBufferFile.h"
+#include "RVersion.h"
+#include "TFileMerger.h"
+#include "TSystem.h"
+#include "TEnv.h"
 
 #ifdef PROJECT_NAME
 #include "PhysicsTools/TheNtupleMaker/interface/treestream.h"
@@ -109,7 +147,19 @@ const int kSUCCESS=0;
 const int kBADOPEN=1;
 const int kBADTREE=2;
 const int kBADBRANCH=3;
-int DEBUGLEVEL=0;
+
+// Debug level and trace flag, read once from the environment
+
+int  DEBUGLEVEL=getenv("DBtreestream") ? atoi(getenv("DBtreestream")) : 0;
+bool TRACE=getenv("TRACEtreestream") != (char*)0;
+
+// Debug output in code executed for every entry is compiled out of
+// release builds (make RELEASE=1, which defines NDEBUG).
+#ifdef NDEBUG
+const bool DEBUGENTRY=false;
+#else
+const bool DEBUGENTRY=true;
+#endif
 
 // Make following visible only to this compilation unit.
 
@@ -130,13 +180,73 @@ namespace
 
   void DBUG(string message, int level=1)
   {
-    if ( getenv("DBtreestream") != (char*)0 )
-      DEBUGLEVEL = atoi(getenv("DBtreestream"));
-    else
-      DEBUGLEVEL = 0;
     if ( DEBUGLEVEL >= level ) cout << message << endl;
   }
 
+  // ----------------------------------------------------------------------
+  // Return name of schema cache file for given file and trees, or a null
+  // string if schema caching has not been requested. The schema is keyed
+  // by the UUID of the file, the requested trees and the ROOT version.
+  // ----------------------------------------------------------------------
+  string schemafile(TFile* file, vector<string>& tname)
+  {
+    char* dirname = getenv("SCHEMAtreestream");
+    if ( dirname == (char*)0 ) return string("");
+    if ( string(dirname) == "" ) return string("");
+
+    string key("");
+    for(size_t i=0; i < tname.size(); i++) key += string("_") + tname[i];
+    for(size_t i=0; i < key.size(); i++)
+      if ( ! isalnum(key[i]) && key[i] != '.' ) key[i] = '_';
+
+    ostringstream os;
+    os << dirname << "/" 
+       << file->GetUUID().AsString() 
+       << key << "_" << ROOT_VERSION_CODE << ".schema";
+    return os.str();
+  }
+
+  // ----------------------------------------------------------------------
+  // Sort ranges [start, stop) and merge those that overlap or touch.
+  // ----------------------------------------------------------------------
+  void mergeranges(vector<pair<int, int> >& ranges)
+  {
+    if ( ranges.size() < 2 ) return;
+    sort(ranges.begin(), ranges.end());
+
+    vector<pair<int, int> > merged(1, ranges[0]);
+    for(size_t i=1; i < ranges.size(); i++)
+      {
+        if ( ranges[i].first <= merged.back().second )
+          merged.back().second = max(merged.back().second, ranges[i].second);
+        else
+          merged.push_back(ranges[i]);
+      }
+    ranges = merged;
+  }
+
+  // ----------------------------------------------------------------------
+  // Return ROOT compression settings, 100 * algorithm + level, for the
+  // given algorithm name. If level < 0 use the level of given settings.
+  // ----------------------------------------------------------------------
+  int compressionsettings(string algorithm, int level, int settings)
+  {
+    for(size_t i=0; i < algorithm.size(); i++)
+      algorithm[i] = toupper(algorithm[i]);
+
+    // algorithm codes from ROOT::RCompressionSetting::EAlgorithm
+    int code = 0;
+    if      ( algorithm == "ZLIB" ) code = 1;
+    else if ( algorithm == "LZMA" ) code = 2;
+    else if ( algorithm == "LZ4"  ) code = 4;
+    else if ( algorithm == "ZSTD" ) code = 5;
+    else
+      fatal("compression - unknown algorithm " + algorithm);
+
+    if ( level < 0 ) level = settings % 100;
+    return 100 * code + level;
+  }
+
   void split(string str, vector<string>& vstr)
   {
     vstr.clear();
@@ -172,7 +282,15 @@ namespace
   exvalue(Field* field, int index=0)
   {
     T val;
-    if ( field->isvector )
+    if ( field->isvector == 3 )
+      {
+        // the last row of a jagged array
+        jagged<T>* d = reinterpret_cast<jagged<T>*>(field->address);
+        if ( d == 0 ) fatal("exvalue - reinterpret_cast failed" + 
+                            string(field->branch->GetName()));
+        val = d->values[d->offsets[d->size()-1] + index];
+      }
+    else if ( field->isvector )
       {
         vector<T>* d = reinterpret_cast<vector<T>*>(field->address);
         if ( d == 0 ) fatal("exvalue - reinterpret_cast failed" + 
@@ -186,7 +304,7 @@ namespace
                             string(field->branch->GetName()));
         val = *d;
       }
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       cout << "\texternal value(" << val << ")" << endl;
     return val;
   }
@@ -197,14 +315,21 @@ namespace
   exsize(Field* field)
   {
     int val = 1;
-    if ( field->isvector )
+    if ( field->isvector == 3 )
+      {
+        jagged<T>* d = reinterpret_cast<jagged<T>*>(field->address);
+        if ( d == 0 ) fatal("exvalue - reinterpret_cast failed" + 
+                            string(field->branch->GetName()));
+        val = d->size() > 0 ? d->count(d->size()-1) : 0;
+      }
+    else if ( field->isvector )
       {
         vector<T>* d = reinterpret_cast<vector<T>*>(field->address);
         if ( d == 0 ) fatal("exvalue - reinterpret_cast failed" + 
                             string(field->branch->GetName()));
         val = d->size();
         //
-        if ( DEBUGLEVEL > 1 )
+        if ( DEBUGENTRY && DEBUGLEVEL > 1 )
           cout << "EXSIZE(" << val << ") " 
                << string(field->branch->GetName()) << endl;
       }
@@ -226,59 +351,33 @@ namespace
     return string(srctype);
   }
 
-  int
-  getexsize(Field* field)
+  // ----------------------------------------------------------------------
+  // Return the function that gives the size of the external buffer of
+  // the given field, or zero if the size is fixed.
+  // ----------------------------------------------------------------------
+  typedef int (*SizeFunction)(Field*);
+
+  SizeFunction
+  getsize(Field* field)
   {
-    int size = 0;
+    if ( ! field->isvector ) return 0;
+
     switch(field->srctype)
       {
-      case 'D':
-        size = exsize<double>(field);
-        break;
-        
-      case 'F':
-        size = exsize<float>(field);
-        break;
-
-      case 'L':
-        size = exsize<long>(field);
-        break;
-              
-      case 'I':
-        size = exsize<int>(field);           
-
-      case 'S':
-        size = exsize<short>(field);
-     
-      case 'B':
-        size = exsize<char>(field);
-
-      case 'O':
-        size = exsize<bool>(field);
-
-      case 'C':
-        size = exsize<string>(field);
-     
-      case 'l':
-        size = exsize<unsigned long>(field);
-        break;
-        
-      case 'i':
-        size = exsize<unsigned int>(field);
-        break;
-   
-      case 's':
-        size = exsize<unsigned short>(field);
-        break;
-
-      case 'b':
-        size = exsize<unsigned char>(field);
-
-      default:
-        size = exsize<double>(field);
-        break;
+      case 'D': return exsize<double>;
+      case 'F': return exsize<float>;
+      case 'L': return exsize<long>;
+      case 'I': return exsize<int>;
+      case 'S': return exsize<short>;
+      case 'B': return exsize<char>;
+      case 'O': return exsize<bool>;
+      case 'C': return exsize<string>;
+      case 'l': return exsize<unsigned long>;
+      case 'i': return exsize<unsigned int>;
+      case 's': return exsize<unsigned short>;
+      case 'b': return exsize<unsigned char>;
+      default:  return exsize<double>;
       }
-    return size;
   }
 
   // ----------------------------------------------------------------------
@@ -295,7 +394,7 @@ namespace
     
     int count = field->size;
     
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       {
         char preamble[160];
         sprintf(preamble,
@@ -370,7 +469,7 @@ namespace
         
       }
     
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       {
         cout << "\tinternal value = " << d->value[0] << endl;
         cout << "END fromexternal" << endl;
@@ -385,7 +484,7 @@ namespace
   {
     int count = field->size;
     
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       {
         char preamble[160];
         sprintf(preamble,
@@ -408,7 +507,7 @@ namespace
       d->value[i] = exvalue<string>(field, i).c_str();
     
  
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       {
         cout << "\tinternal value(" << d->value[0] << ")" << endl;
         void* address = (void*)(d->value[0].c_str());
@@ -417,6 +516,209 @@ namespace
       }
   }
 
+  // ----------------------------------------------------------------------
+  // Return the function that copies data from the external buffer of the
+  // given field to its internal buffer, whose type is given by iotype.
+  // ----------------------------------------------------------------------
+  typedef void (*StoreFunction)(Field*);
+
+  // A leaf counter holds a single value, whatever the value of its size 
+  // field, which is the length of its array
+  template <class T>
+  void
+  storecounter(Field* field)
+  {
+    int size = field->size;
+    field->size = 1;
+    fromexternal<T>(field);
+    field->size = size;
+  }
+
+  StoreFunction
+  getstore(Field* field)
+  {
+    if ( field->iscounter )
+      switch(field->iotype)
+        {
+        case 'L': return storecounter<long>;
+        case 'I': return storecounter<int>;
+        case 'S': return storecounter<short>;
+        case 'B': return storecounter<char>;
+        case 'l': return storecounter<unsigned long>;
+        case 'i': return storecounter<unsigned int>;
+        case 's': return storecounter<unsigned short>;
+        case 'b': return storecounter<unsigned char>;
+        default:  
+          fatal("store - leaf counter " + field->fullname + 
+                " is not of integer type");
+        }
+
+    switch(field->iotype)
+      {
+      case 'D': return fromexternal<double>;
+      case 'F': return fromexternal<float>;
+      case 'L': return fromexternal<long>;
+      case 'I': return fromexternal<int>;
+      case 'S': return fromexternal<short>;
+      case 'B': return fromexternal<char>;
+      case 'O': return fromexternal<int>; // see createbranch
+      case 'C': return fromexternal<string>;
+      case 'l': return fromexternal<unsigned long>;
+      case 'i': return fromexternal<unsigned int>;
+      case 's': return fromexternal<unsigned short>;
+      case 'b': return fromexternal<unsigned char>;
+      default:  return fromexternal<double>;
+      }
+  }
+
+  // ----------------------------------------------------------------------
+  // Return the type of the values in the buffer of given leaf using the
+  // same codes as srctype, or zero if we do not know how to copy them
+  // directly.
+  // ----------------------------------------------------------------------
+  char
+  getleaftype(TLeaf* leaf)
+  {
+    // The values of a TLeafElement, e.g., a member of a split 
+    // TClonesArray, are not in a contiguous buffer.
+    if ( leaf->InheritsFrom(TLeafElement::Class()) ) return 0;
+
+    string tname(leaf->GetTypeName());
+    if      ( tname == "Double_t" || tname == "Double32_t" ) return 'D';
+    else if ( tname == "Float_t"  || tname == "Float16_t" )  return 'F';
+    else if ( tname == "Long64_t" || tname == "Long_t" )     return 'L';
+    else if ( tname == "Int_t" )                             return 'I';
+    else if ( tname == "Short_t" )                           return 'S';
+    else if ( tname == "Char_t" )                            return 'B';
+    else if ( tname == "Bool_t" )                            return 'O';
+    else if ( tname == "ULong64_t" || tname == "ULong_t" )   return 'l';
+    else if ( tname == "UInt_t" )                            return 'i';
+    else if ( tname == "UShort_t" )                          return 's';
+    else if ( tname == "UChar_t" )                           return 'b';
+    return 0;
+  }
+
+  // ----------------------------------------------------------------------
+  // Copy count values from src to dest. If the types differ, convert
+  // element by element, otherwise copy the block of memory.
+  // ----------------------------------------------------------------------
+  template <class T, class S>
+  inline
+  void
+  copyvalues(T* dest, const S* src, int count)
+  {
+    for(int i=0; i < count; i++) dest[i] = static_cast<T>(src[i]);
+  }
+
+  template <class T>
+  inline
+  void
+  copyvalues(T* dest, const T* src, int count)
+  {
+    memcpy(dest, src, count * sizeof(T));
+  }
+
+  // ----------------------------------------------------------------------
+  // Copy count values from src, of type srctype, to dest. Return false if 
+  // we do not know how to copy values of type srctype.
+  // Note: T is the type of dest
+  // ----------------------------------------------------------------------
+  template <class T>
+  inline
+  bool
+  copyfrom(T* dest, const void* src, char srctype, int count)
+  {
+    switch(srctype)
+      {
+      case 'D':
+        copyvalues(dest, static_cast<const Double_t*>(src), count);
+        break;
+
+      case 'F':
+        copyvalues(dest, static_cast<const Float_t*>(src), count);
+        break;
+
+      case 'L':
+        copyvalues(dest, static_cast<const Long64_t*>(src), count);
+        break;
+
+      case 'I':
+        copyvalues(dest, static_cast<const Int_t*>(src), count);
+        break;
+
+      case 'S':
+        copyvalues(dest, static_cast<const Short_t*>(src), count);
+        break;
+
+      case 'B':
+        copyvalues(dest, static_cast<const Char_t*>(src), count);
+        break;
+
+      case 'O':
+        copyvalues(dest, static_cast<const Bool_t*>(src), count);
+        break;
+
+      case 'l':
+        copyvalues(dest, static_cast<const ULong64_t*>(src), count);
+        break;
+
+      case 'i':
+        copyvalues(dest, static_cast<const UInt_t*>(src), count);
+        break;
+
+      case 's':
+        copyvalues(dest, static_cast<const UShort_t*>(src), count);
+        break;
+
+      case 'b':
+        copyvalues(dest, static_cast<const UChar_t*>(src), count);
+        break;
+
+      default:
+        return false;
+      }
+    return true;
+  }
+
+  // ----------------------------------------------------------------------
+  // Copy count values from the buffer of given leaf to dest.
+  // Note: T is the type of dest, leaftype the type of the leaf buffer
+  // ----------------------------------------------------------------------
+  template <class T>
+  inline
+  void
+  fromleaf(T* dest, TLeaf* leaf, char leaftype, int count, int first=0)
+  {
+    if ( leaftype != 0 )
+      {
+        const char* src = static_cast<const char*>(leaf->GetValuePointer());
+        if ( copyfrom(dest, src + first * leaf->GetLenType(), 
+                      leaftype, count) ) return;
+      }
+    for(int i=0; i < count; i++)
+      dest[i] = static_cast<T>(leaf->GetValue(first + i));
+  }
+
+  // vector<bool> does not store its elements contiguously.
+  // Note: the values are copied to d starting at element at
+  template <class T>
+  inline
+  void
+  fromleaf(vector<T>& d, TLeaf* leaf, char leaftype, int count, int first=0,
+           int at=0)
+  {
+    if ( count > 0 ) fromleaf(&d[at], leaf, leaftype, count, first);
+  }
+
+  template <>
+  inline
+  void
+  fromleaf(vector<bool>& d, TLeaf* leaf, char, int count, int first, int at)
+  {
+    for(int i=0; i < count; i++)
+      d[at + i] = static_cast<bool>(leaf->GetValue(first + i));
+  }
+
   // ----------------------------------------------------------------------
   // Copy to external buffer from internal buffer.
   // Note: T is the type of the external buffer
@@ -435,7 +737,7 @@ namespace
     int count = total_count_per_leaf / count_per_leaf;
     //count = min(count, field->maxsize);
 
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       {
         char preamble[160];
         sprintf(preamble,
@@ -452,75 +754,97 @@ namespace
 
     // Make sure external buffer is of the correct size
 
-    if ( field->isvector )
+    if ( field->isvector == 1 )
       {
-	// if count_per_leaf == 1, then we assume the return buffer
-	// is vector<T>, in which case field->isvector = 1
+	// vector<T>
 	//
-	// if count_per_leaf > 1, then we assume the return buffer
-	// if vector<vector<T> >, in which case field->isvector should be 2
-	if ( count_per_leaf == 1 )
-	  {
-	    // vector<T>
+	// if count_per_leaf > 1, the rows are stored contiguously, with 
+	// row ii starting at element ii * count_per_leaf. This avoids the
+	// allocations needed to fill a vector<vector<T> >.
 	    
-	    vector<T>* ptr = reinterpret_cast<vector<T>*>(field->address);
-	    if ( ptr == 0 ) fatal("toexternal - reinterpret_cast failed" + 
-				string(field->fullname));
+	vector<T>* ptr = reinterpret_cast<vector<T>*>(field->address);
+	if ( ptr == 0 ) fatal("toexternal - reinterpret_cast failed" + 
+			      string(field->fullname));
 	    
-	    // NOTE: d is the same object as *ptr
-	    vector<T>& d = *ptr;
+	// NOTE: d is the same object as *ptr
+	vector<T>& d = *ptr;
 	    
-	    if ( (int)d.size() != count ) d.resize(count, 0);
+	if ( (int)d.size() != total_count_per_leaf ) 
+	  d.resize(total_count_per_leaf, 0);
         
-	    if ( (int)d.size() != count ) 
-	      fatal("toexternal - unable to resize external buffer for " + 
-		    field->leafname);
+	if ( (int)d.size() != total_count_per_leaf ) 
+	  fatal("toexternal - unable to resize external buffer for " + 
+		field->leafname);
         
-	    for(int index=0; index < count; index++)
-	      d[index] = static_cast<T>(field->leaf->GetValue(index));
+	fromleaf(d, field->leaf, field->leaftype, total_count_per_leaf);
 
-	    if ( DEBUGLEVEL > 0 )
-	      {
-		for(size_t ii=0; ii < d.size(); ii++)
-		  cout << "\ttoexternal "
-		       << field->fullname << "[" << ii << "]\t"
-		       << d[ii] << endl;		  
-	      }
-	  }
-	else
+	if ( DEBUGENTRY && DEBUGLEVEL > 0 )
 	  {
-	    // vector<vector<T> >
-
-	    vector<vector<T> >* ptr = reinterpret_cast<vector<vector<T> >*>(field->address);
-	    if ( ptr == 0 ) fatal("toexternal - reinterpret_cast failed" + 
-				string(field->fullname));
-
-	    // NOTE: d is the same object as *ptr
-	    vector<vector<T> >& d = *ptr;
-	    
-	    int index = 0;
-	    d.clear();
-	    vector<T> v(count_per_leaf);
+	    for(size_t ii=0; ii < d.size(); ii++)
+	      cout << "\ttoexternal "
+		   << field->fullname << "[" << ii << "]\t"
+		   << d[ii] << endl;		  
+	  }
+      }
+    else if ( field->isvector == 3 )
+      {
+	// jagged<T>: append a row
+
+	jagged<T>* ptr = reinterpret_cast<jagged<T>*>(field->address);
+	if ( ptr == 0 ) fatal("toexternal - reinterpret_cast failed" + 
+			      string(field->fullname));
+
+	// NOTE: d is the same object as *ptr
+	jagged<T>& d = *ptr;
+
+	if ( d.offsets.size() == 0 ) d.offsets.push_back(0);
+	int at = d.values.size();
+	d.values.resize(at + total_count_per_leaf);
+	fromleaf(d.values, field->leaf, field->leaftype, 
+		 total_count_per_leaf, 0, at);
+	d.offsets.push_back(d.values.size());
+
+	if ( DEBUGENTRY && DEBUGLEVEL > 0 )
+	  cout << "\ttoexternal " << field->fullname 
+	       << "\trow " << d.size() - 1 
+	       << "\tcount " << total_count_per_leaf << endl;
+      }
+    else if ( field->isvector == 2 )
+      {
+	// vector<vector<T> >
+	//
+	// Resize rather than rebuild the buffer so that the storage of 
+	// rows present in consecutive entries is reused. Note: rows removed
+	// when the count decreases are freed and must be allocated again 
+	// when it increases. Use a flat vector<T> or jagged<T> to avoid 
+	// allocations altogether.
+
+	vector<vector<T> >* ptr = reinterpret_cast<vector<vector<T> >*>(field->address);
+	if ( ptr == 0 ) fatal("toexternal - reinterpret_cast failed" + 
+			      string(field->fullname));
+
+	// NOTE: d is the same object as *ptr
+	vector<vector<T> >& d = *ptr;
 	    
-	    for(int ii=0; ii < count; ii++)
-	      {
-		for(size_t jj=0; jj < v.size(); jj++)
-		  {
-		    v[jj] = static_cast<T>(field->leaf->GetValue(index));
-		    index++;
-		  }
-		d.push_back(v);
-	      }
+	if ( (int)d.size() != count ) d.resize(count);
 
-	    if ( DEBUGLEVEL > 0 )
+	int index = 0;
+	for(int ii=0; ii < count; ii++)
+	  {
+	    vector<T>& v = d[ii];
+	    if ( (int)v.size() != count_per_leaf ) v.resize(count_per_leaf, 0);
+	    fromleaf(v, field->leaf, field->leaftype, count_per_leaf, index);
+	    index += count_per_leaf;
+	  }
+
+	if ( DEBUGENTRY && DEBUGLEVEL > 0 )
+	  {
+	    for(size_t ii=0; ii < d.size(); ii++)
 	      {
-		for(size_t ii=0; ii < d.size(); ii++)
-		  {
-		    for(size_t jj=0; jj < d[ii].size(); jj++)
-		      cout << "\ttoexternal "
-			   << field->fullname << "[" << ii << "][" << jj <<  "]\t"
-			   << d[ii][jj] << endl;
-		  }
+		for(size_t jj=0; jj < d[ii].size(); jj++)
+		  cout << "\ttoexternal "
+		       << field->fullname << "[" << ii << "][" << jj <<  "]\t"
+		       << d[ii][jj] << endl;
 	      }
 	  }
       }
@@ -530,16 +854,16 @@ namespace
         if ( d == 0 ) fatal("toexternal - reinterpret_cast failed" + 
                             string(field->fullname));
         
-        *d = static_cast<T>(field->leaf->GetValue());
+        fromleaf(d, field->leaf, field->leaftype, 1);
 
-        if ( DEBUGLEVEL > 0 )
+        if ( DEBUGENTRY && DEBUGLEVEL > 0 )
           {
             cout << "\ttoexternal " << field->fullname << "\t" << *d;
             if ( field->iscounter ) cout << " (counter)";
             cout << endl;
           }
       }
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       cout << "END toexternal" << endl;
   }
 
@@ -550,7 +874,7 @@ namespace
   {
     int count = field->leaf->GetLen();
 
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       {
         char preamble[160];
         sprintf(preamble,
@@ -578,13 +902,105 @@ namespace
       }
     d->resize(size);
 
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       cout << "\texternal value = " << *d << endl;
 
-    if ( DEBUGLEVEL > 0 )
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
       cout << "END toexternal" << endl;
   }
 
+  // ----------------------------------------------------------------------
+  // Execute a step of the plan for reading or storing variables, and, 
+  // while tracing, record the time spent and the number of bytes.
+  // ----------------------------------------------------------------------
+  inline
+  double
+  since(chrono::steady_clock::time_point start)
+  {
+    chrono::duration<double> t = chrono::steady_clock::now() - start;
+    return t.count();
+  }
+
+  void
+  traceread(ReadStep* step, int localentry)
+  {
+    Field* field = step->field;
+    chrono::steady_clock::time_point start = chrono::steady_clock::now();
+    int nbytes = field->branch->GetEntry(localentry);
+    if ( step->copy ) step->copy(field);
+    field->seconds += since(start);
+    field->nbytes  += nbytes;
+    field->ncalls++;
+  }
+
+  inline
+  void
+  storestep(StoreStep* step)
+  {
+    Field* field = step->field;
+
+    if ( DEBUGENTRY && DEBUGLEVEL > 0 )
+      cout << "commit( " + string(field->leaf->GetName()) << " )" << endl;
+
+    // Ok, get the count for this variable and, if the variable has a 
+    // leaf counter, update the size field of the latter.
+    if ( step->size )
+      {
+        field->size = min(step->size(field), field->maxsize);
+        if ( step->counter ) step->counter->size = field->size;
+
+        if ( DEBUGENTRY && DEBUGLEVEL > 0 )
+          cout << "\tfield->size: " << field->size << endl;      
+      }
+
+    // Copy data to internal buffers from external buffers
+    // iotype <- srctype
+    step->copy(field);
+  }
+
+  void
+  tracestore(StoreStep* step)
+  {
+    Field* field = step->field;
+    chrono::steady_clock::time_point start = chrono::steady_clock::now();
+    storestep(step);
+    field->seconds += since(start);
+    field->nbytes  += field->size * field->leaf->GetLenType();
+    field->ncalls++;
+  }
+
+  // Return table of time spent and bytes per traced variable
+  string
+  tracereport(SelectedData& selecteddata)
+  {
+    ostringstream out;
+    char record[1024];
+    sprintf(record, "%-48s %10s %12s %12s\n", 
+            "variable", "entries", "Mbytes", "us/entry");
+    out << record;
+
+    double nbytes  = 0;
+    double seconds = 0;
+    SelectedData::iterator it;
+    for(it = selecteddata.begin(); it != selecteddata.end(); it++)
+      {
+        Field* field = it->second;
+        if ( field == 0 || field->ncalls < 1 ) continue;
+        sprintf(record, "%-48s %10d %12.3f %12.3f\n",
+                field->fullname.c_str(),
+                field->ncalls,
+                field->nbytes / 1.e6,
+                1.e6 * field->seconds / field->ncalls);
+        out << record;
+        nbytes  += field->nbytes;
+        seconds += field->seconds;
+      }
+    sprintf(record, "%-48s %10s %12.3f %12s (%.3f s)\n", 
+            "total", "", nbytes / 1.e6, "", seconds);
+    out << record;
+    return out.str();
+  }
+
   // ----------------------------------------------------------------------
   // IMPORTANT: In tree->Branch(..), it is necessary to use the correct 
   // type when giving the address of the variable from which data are to 
@@ -792,27 +1208,314 @@ namespace
   }
 
 
-  void 
-  readbranch(Field* field, int entry)
+  // ----------------------------------------------------------------------
+  // Copy count values to the caller's array bound to given column, 
+  // starting at element index, from src if given, otherwise from the
+  // buffer of the leaf bound to the column.
+  // ----------------------------------------------------------------------
+  template <class T>
+  inline
+  void
+  tocolumn(T* dest, Column& column, int count, const void* src)
   {
-    assert(field != 0);
-    if ( field->branch == 0 ) return;
-
-    // Read entry for current branch
+    if ( src == 0 )
+      fromleaf(dest, column.field->leaf, column.leaftype, count);
+    else
+      copyfrom(dest, src, column.leaftype, count);
+  }
 
-    field->branch->GetEntry(entry);
+  void
+  tocolumn(Column& column, int index, int count, const void* src=0)
+  {
+    switch(column.srctype)
+      {
+      case 'D':
+        tocolumn(static_cast<double*>(column.values) + index,
+                 column, count, src);
+        break;
 
-    // If address field is zero, this signals that 
-    // the caller has not provided a location into which 
-    // the value of the current variable is to be written.
-    // This should happen only for leaf counter variables.
-    // In this case, just return
+      case 'F':
+        tocolumn(static_cast<float*>(column.values) + index,
+                 column, count, src);
+        break;
 
-    if ( field->address == 0) return;
+      case 'L':
+        tocolumn(static_cast<long*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 'I':
+        tocolumn(static_cast<int*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 'S':
+        tocolumn(static_cast<short*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 'O':
+        tocolumn(static_cast<bool*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 'l':
+        tocolumn(static_cast<unsigned long*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 'i':
+        tocolumn(static_cast<unsigned int*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 's':
+        tocolumn(static_cast<unsigned short*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      case 'b':
+        tocolumn(static_cast<unsigned char*>(column.values) + index,
+                 column, count, src);
+        break;
+
+      default:
+        fatal(string("readcolumns - unsupported type ") + column.srctype);
+      }
+  }
+
+  // ----------------------------------------------------------------------
+  // Return size in bytes of a value of given type
+  // ----------------------------------------------------------------------
+  int
+  typesize(char srctype)
+  {
+    switch(srctype)
+      {
+      case 'D': return sizeof(Double_t);
+      case 'F': return sizeof(Float_t);
+      case 'L': return sizeof(Long64_t);
+      case 'I': return sizeof(Int_t);
+      case 'S': return sizeof(Short_t);
+      case 'B': return sizeof(Char_t);
+      case 'O': return sizeof(Bool_t);
+      case 'l': return sizeof(ULong64_t);
+      case 'i': return sizeof(UInt_t);
+      case 's': return sizeof(UShort_t);
+      case 'b': return sizeof(UChar_t);
+      default:
+        fatal(string("typesize - unsupported type ") + srctype);
+      }
+    return 0;
+  }
+
+  // ----------------------------------------------------------------------
+  // Copy count values, starting at element index of the caller's array
+  // bound to given column, to the output buffer of the column's field.
+  // ----------------------------------------------------------------------
+  template <class T>
+  inline
+  void
+  fromcolumn(Field* field, const void* src, char srctype, int count)
+  {
+    FieldBuffer<T>* d = static_cast<FieldBuffer<T>*>(field);
+    copyfrom(&d->value[0], src, srctype, count);
+  }
+
+  void
+  fromcolumn(Column& column, int index, int count)
+  {
+    const void* src = static_cast<const char*>(column.values) 
+      + index * typesize(column.srctype);
+
+    Field* field = column.field;
+    switch(field->iotype)
+      {
+      case 'D':
+        fromcolumn<double>(field, src, column.srctype, count);
+        break;
+
+      case 'F':
+        fromcolumn<float>(field, src, column.srctype, count);
+        break;
+
+      case 'L':
+        fromcolumn<long>(field, src, column.srctype, count);
+        break;
+
+      case 'I':
+      case 'O':
+        fromcolumn<int>(field, src, column.srctype, count);
+        break;
+
+      case 'S':
+        fromcolumn<short>(field, src, column.srctype, count);
+        break;
+
+      case 'i':
+        fromcolumn<unsigned int>(field, src, column.srctype, count);
+        break;
+
+      case 's':
+        fromcolumn<unsigned short>(field, src, column.srctype, count);
+        break;
+
+      case 'l':
+        fromcolumn<unsigned long>(field, src, column.srctype, count);
+        break;
+
+      case 'b':
+        fromcolumn<unsigned char>(field, src, column.srctype, count);
+        break;
+
+      default:
+        fatal(string("writecolumns - unsupported type ") + field->iotype);
+      }
+  }
+
+  // ----------------------------------------------------------------------
+  // Set the value of the given leaf counter, which can be of any integer 
+  // type, to count.
+  // ----------------------------------------------------------------------
+  template <class T>
+  inline
+  void
+  setcounter(Field* field, int count)
+  {
+    FieldBuffer<T>* d = dynamic_cast<FieldBuffer<T>*>(field);
+    if ( d == 0 ) fatal("setcounter - dynamic_cast failed " + 
+                        field->fullname);
+    d->value[0] = static_cast<T>(count);
+  }
+
+  void
+  setcounter(Field* field, int count)
+  {
+    switch(field->iotype)
+      {
+      case 'L': setcounter<long>(field, count); break;
+      case 'I': setcounter<int>(field, count); break;
+      case 'S': setcounter<short>(field, count); break;
+      case 'B': setcounter<char>(field, count); break;
+      case 'l': setcounter<unsigned long>(field, count); break;
+      case 'i': setcounter<unsigned int>(field, count); break;
+      case 's': setcounter<unsigned short>(field, count); break;
+      case 'b': setcounter<unsigned char>(field, count); break;
+      default:  
+        fatal("writecolumns - leaf counter " + field->fullname + 
+              " is not of integer type");
+      }
+  }
+
+  // ----------------------------------------------------------------------
+  // Read count entries of a simple variable, starting at given entry of 
+  // the current tree, into the caller's array bound to given column, 
+  // starting at element index. Whole baskets are decompressed and 
+  // deserialized at a time. Return the number of entries read, which
+  // is zero if the branch does not support bulk reads.
+  // ----------------------------------------------------------------------
+  int
+  readbulk(Column& column, int index, Long64_t entry, int count,
+           TBufferFile& buffer)
+  {
+    int nread = 0;
+#if ROOT_VERSION_CODE >= ROOT_VERSION(6,16,0)
+    if ( column.counter != 0 ) return 0;
+    if ( column.leaftype == 0 ) return 0;
+    if ( column.field->leaf->GetLen() != 1 ) return 0;
+
+    TBranch* branch = column.field->branch;
+    if ( ! branch->GetBulkRead().SupportsBulkRead() ) return 0;
+
+    // Bulk reads must start at the first entry of a basket
+
+    Long64_t* basketentry = branch->GetBasketEntry();
+    int nbaskets = branch->GetWriteBasket();
+    while ( nread < count )
+      {
+        Long64_t first = entry + nread;
+        int ibasket = (int)(upper_bound(basketentry,
+                                        basketentry + nbaskets,
+                                        first) - basketentry) - 1;
+        if ( ibasket < 0 ) break;
+
+        int nentries = 
+          branch->GetBulkRead().GetEntriesDeserialized(basketentry[ibasket],
+                                                       buffer);
+        int skip = (int)(first - basketentry[ibasket]);
+        int len  = min(nentries - skip, count - nread);
+        if ( len < 1 ) break;
+
+        const void* src = buffer.GetCurrent() + 
+          skip * column.field->leaf->GetLenType();
+        tocolumn(column, index + nread, len, src);
+        nread += len;
+      }
+#endif
+    return nread;
+  }
+
+  // ----------------------------------------------------------------------
+  // Get addresses of the first count vectors in v and return the number of
+  // elements in the shortest, or zero if there are fewer than count vectors.
+  // ----------------------------------------------------------------------
+  template <class T>
+  int
+  getarrays(vector<vector<T> >& v, size_t count, vector<void*>& arrays)
+  {
+    if ( count == 0 || v.size() < count ) return 0;
+    int nrows = v[0].size();
+    for(size_t c=0; c < count; c++)
+      {
+        nrows = min(nrows, (int)v[c].size());
+        arrays.push_back(v[c].size() > 0 ? &v[c][0] : 0);
+      }
+    return nrows;
+  }
+
+  // ----------------------------------------------------------------------
+  // Update the branch and leaf pointers of given field. This is needed
+  // whenever we switch to another tree in a chain.
+  // ----------------------------------------------------------------------
+  void
+  updatefield(Field* field)
+  {
+    if ( field == 0 )  fatal("update - zero field pointer");
+
+    if ( field->chain == 0 ) fatal("update - zero field->chain pointer");
+      
+    field->branch = field->chain->GetBranch(field->branchname.c_str());
+    if ( field->branch == 0 )
+      fatal("update - pointer is zero for tree/branch (" 
+            + field->fullname + ")");
+
+    field->leaf = field->branch->GetLeaf(field->leafname.c_str());
+    if ( field->leaf == 0 ) fatal("update - pointer is zero for leaf "
+                                  + field->leafname);
+  }
+
+  // ----------------------------------------------------------------------
+  // Return the function that copies data from the internal buffer of the
+  // given field to its external buffer, or zero if there is nothing to
+  // copy.
+  // ----------------------------------------------------------------------
+  typedef void (*CopyFunction)(Field*);
+
+  CopyFunction
+  getcopy(Field* field)
+  {
+    assert(field != 0);
+
+    // If address field is zero, this signals that 
+    // the caller has not provided a location into which 
+    // the value of the current variable is to be written.
+    // This should happen only for leaf counter variables.
+
+    if ( field->address == 0) return 0;
 
     // If this is intrinsically a vector type, we let Root handle it
     // directly
-    if ( field->iotype == 'v' ) return;
+    if ( field->iotype == 'v' ) return 0;
     
     // Copy data from internal to external buffers
     // iotype -> srctype
@@ -820,56 +1523,43 @@ namespace
     switch(field->srctype)
       {
       case 'D':
-        toexternal<double>(field);
-        break;
+        return toexternal<double>;
 	
       case 'F':
-        toexternal<float>(field);
-        break;
+        return toexternal<float>;
         
       case 'L':
-        toexternal<long>(field);
-        break;
+        return toexternal<long>;
         
       case 'I':
-        toexternal<int>(field);
-        break;
+        return toexternal<int>;
         
       case 'S':
-        toexternal<short>(field);
-        break;
+        return toexternal<short>;
 
       case 'B':
-        toexternal<char>(field);
-        break;
+        return toexternal<char>;
 
       case 'O':
-        toexternal<bool>(field);
-        break;
+        return toexternal<bool>;
 
       case 'C':
-        toexternal<string>(field);
-        break;
+        return toexternal<string>;
 	
       case 'l':
-        toexternal<unsigned long>(field);
-        break;
+        return toexternal<unsigned long>;
 	
       case 'i':
-        toexternal<unsigned int>(field);
-        break;
+        return toexternal<unsigned int>;
 
       case 's':
-        toexternal<unsigned short>(field);
-        break;
+        return toexternal<unsigned short>;
 
       case 'b':
-        toexternal<unsigned char>(field);
-        break;
+        return toexternal<unsigned char>;
 	
       default:
-        toexternal<double>(field);
-        break;
+        return toexternal<double>;
       }
   }
 }
@@ -888,13 +1578,29 @@ itreestream::itreestream()
     _buffer(vector<double>(1000)),
     data(Data()),
     selecteddata(SelectedData()),
+    _plan(vector<ReadStep>()),
+    _replan(true),
+    _eager(map<string, int>()),
+    _lazy(vector<ReadStep>()),
+    _loaded(vector<int>()),
+    _lazymap(map<string, int>()),
+    _nread(0),
+    _localentry(0),
+    _cachesize(0),
+    _ranges(vector<pair<int, int> >()),
+    _range(0),
+    _next(0),
     _delete(true),
+    _indexfile(""),
     _treename(""),
-    _treenames(vector<string>())
+    _treenames(vector<string>()),
+    _trace(TRACE),
+    _asyncprefetch(-1)
 {}
 
 
-itreestream::itreestream(string filename_, string treename, int bufsize)
+itreestream::itreestream(string filename_, string treename, int bufsize,
+                         string indexfile)
   : _tree(0),
     _chain(0),
     _statuscode(kSUCCESS),
@@ -905,9 +1611,24 @@ itreestream::itreestream(string filename_, string treename, int bufsize)
     _buffer(vector<double>(bufsize)),
     data(Data()),
     selecteddata(SelectedData()),
+    _plan(vector<ReadStep>()),
+    _replan(true),
+    _eager(map<string, int>()),
+    _lazy(vector<ReadStep>()),
+    _loaded(vector<int>()),
+    _lazymap(map<string, int>()),
+    _nread(0),
+    _localentry(0),
+    _cachesize(0),
+    _ranges(vector<pair<int, int> >()),
+    _range(0),
+    _next(0),
     _delete(true),
+    _indexfile(indexfile),
     _treename(""),
-    _treenames(vector<string>())    
+    _treenames(vector<string>()),
+    _trace(TRACE),
+    _asyncprefetch(-1)
 {
   vector<string> fname;
   split(filename_, fname);
@@ -917,7 +1638,8 @@ itreestream::itreestream(string filename_, string treename, int bufsize)
   _open(fname, tname);
 }
 
-itreestream::itreestream(vector<string>& fname, string treename, int bufsize)
+itreestream::itreestream(vector<string>& fname, string treename, int bufsize,
+                         string indexfile)
   : _tree(0),
     _chain(0),
     _statuscode(kSUCCESS),
@@ -928,9 +1650,24 @@ itreestream::itreestream(vector<string>& fname, string treename, int bufsize)
     _buffer(vector<double>(bufsize)),
     data(Data()),
     selecteddata(SelectedData()),
+    _plan(vector<ReadStep>()),
+    _replan(true),
+    _eager(map<string, int>()),
+    _lazy(vector<ReadStep>()),
+    _loaded(vector<int>()),
+    _lazymap(map<string, int>()),
+    _nread(0),
+    _localentry(0),
+    _cachesize(0),
+    _ranges(vector<pair<int, int> >()),
+    _range(0),
+    _next(0),
     _delete(true),
+    _indexfile(indexfile),
     _treename(""),
-    _treenames(vector<string>())    
+    _treenames(vector<string>()),
+    _trace(TRACE),
+    _asyncprefetch(-1)
 {
   vector<string> tname;
   if ( treename != "" )
@@ -968,6 +1705,13 @@ itreestream::_open(vector<string>& fname, vector<string>& tname)
 
   _buffer.clear();
 
+  // Entries are counted only when needed
+  _entries = -1;
+
+  string schema("");
+  bool cached = false;
+  map<string, string> chainnames;
+
   if ( tname.size() > 0 )
     _treename = tname[0];
   else
@@ -1007,51 +1751,65 @@ itreestream::_open(vector<string>& fname, vector<string>& tname)
         fatal("itreestream - unable to open file " + filepath[0]);
       file_->cd();
 
+      // ----------------------------------------
+      // If the schema of these trees has been
+      // cached, there is no need to read the
+      // trees from the file.
+      // ----------------------------------------
+      schema = schemafile(file_, tname);
+      cached = _readschema(schema, tname, chainnames);
 
-      // get all tree names
-      DBUG("itreestream::ctor - before _gettree");
-      _gettree(file_);
-      DBUG("itreestream::ctor - after _gettree");
-
-      if ( tname.size() == (size_t)0 )
+      if ( cached )
         {
-          // ----------------------------------------
-          // No tree name was given. Here is the default
-          // action: Use the first tree found and warn
-	  // user.
-          // ----------------------------------------
-	  tname.resize(1);
-	  tname[0]  = _treenames[0];
-	  _treename = _treenames[0];
-	  _tree = (TTree*)file_->Get(_treename.c_str());
-          if ( ! _tree )
-            fatal("itreestream - NO tree found in file " + filepath[0]);
-          
-          cout << "** WARNING ** itreestream - tree not given; using tree: " 
-               << _treename << endl;
+          DBUG("itreestream::ctor - using schema " + schema);
         }
-      else if ( TString(tname[0].c_str()).Contains("*") )
-	{
-          // ----------------------------------------
-          // All trees requested
-          // ----------------------------------------	  
-	  tname.resize(_treenames.size());
-	  copy(_treenames.begin(), _treenames.end(), tname.begin());
-	  _treename = _treenames[0];
-	  _tree = (TTree*)file_->Get(_treename.c_str());
-          if ( ! _tree )
-            fatal("itreestream - NO tree found in file " + filepath[0]);	  
-	}
       else
-	{
-          // ----------------------------------------
-          // At least one tree requested
-          // ----------------------------------------	  
-	  _treename = tname[0];
-	  _tree = (TTree*)file_->Get(_treename.c_str());
-          if ( ! _tree )
-            fatal("itreestream - NO tree found in file " + filepath[0]);	  
-	}	
+        {
+          // get all tree names
+          DBUG("itreestream::ctor - before _gettree");
+          _gettree(file_);
+          DBUG("itreestream::ctor - after _gettree");
+
+          if ( tname.size() == (size_t)0 )
+            {
+              // ----------------------------------------
+              // No tree name was given. Here is the default
+              // action: Use the first tree found and warn
+              // user.
+              // ----------------------------------------
+              tname.resize(1);
+              tname[0]  = _treenames[0];
+              _treename = _treenames[0];
+              _tree = (TTree*)file_->Get(_treename.c_str());
+              if ( ! _tree )
+                fatal("itreestream - NO tree found in file " + filepath[0]);
+          
+              cout << "** WARNING ** itreestream - tree not given; using tree: " 
+                   << _treename << endl;
+            }
+          else if ( TString(tname[0].c_str()).Contains("*") )
+            {
+              // ----------------------------------------
+              // All trees requested
+              // ----------------------------------------     
+              tname.resize(_treenames.size());
+              copy(_treenames.begin(), _treenames.end(), tname.begin());
+              _treename = _treenames[0];
+              _tree = (TTree*)file_->Get(_treename.c_str());
+              if ( ! _tree )
+                fatal("itreestream - NO tree found in file " + filepath[0]);          
+            }
+          else
+            {
+              // ----------------------------------------
+              // At least one tree requested
+              // ----------------------------------------     
+              _treename = tname[0];
+              _tree = (TTree*)file_->Get(_treename.c_str());
+              if ( ! _tree )
+                fatal("itreestream - NO tree found in file " + filepath[0]);          
+            }       
+        }
       
       string message("itreestream::ctor - treename: " + _treename);
       DBUG(message);
@@ -1064,16 +1822,20 @@ itreestream::_open(vector<string>& fname, vector<string>& tname)
       DBUG("itreestream::ctor - after file->Close");
 
       // ----------------------------------------
-      // Create a chain of files
+      // Create a chain of files. Files are not
+      // opened until they are needed. If the
+      // number of entries of a file is known 
+      // from the index, tell the chain so that
+      // it need never open the file to count.
       // ----------------------------------------
-      // WARNING: This might be slow for large chains. 
-
+      vector<Long64_t> nentries(filepath.size(), TTree::kMaxEntries);
+      _readindex(nentries);
       
       DBUG("itreestream::ctor - new TChain", 2);
       _chain = new TChain(tname[0].c_str());
       if ( ! _chain ) fatal("itreestream - Unable to create chain");
       for(size_t i=0; i < filepath.size(); i++)
-	_chain->Add(filepath[i].c_str());
+	_chain->Add(filepath[i].c_str(), nentries[i]);
       _chainmap[tname[0]] = _chain;
 
       // ----------------------------------------
@@ -1084,19 +1846,40 @@ itreestream::_open(vector<string>& fname, vector<string>& tname)
           DBUG("itreestream::ctor - AddFriend " + tname[i], 2);
           _chainmap[tname[i]] = new TChain(tname[i].c_str());
 	  for(size_t j=0; j < filepath.size(); j++)
-	    _chainmap[tname[i]]->Add(filepath[j].c_str());	  
+	    _chainmap[tname[i]]->Add(filepath[j].c_str(), nentries[j]);
           _chain->AddFriend(_chainmap[tname[i]]);
         }
       
-      DBUG("itreestream::ctor - GetEntries", 2);
-      _entries = _chain->GetEntries();
-      
       // ----------------------------------------
       // Update tree pointer
       // ----------------------------------------
       _tree = _chain; 
     }
 
+  // ----------------------------------------
+  // If the schema was cached, just associate
+  // each field with its chain. Its branch and
+  // leaf are found when the field is used.
+  // ----------------------------------------
+  if ( cached )
+    {
+      Data::iterator it;
+      for(it=data.begin(); it != data.end(); it++)
+        {
+          map<string, TChain*>::iterator 
+            c = _chainmap.find(chainnames[it->first]);
+          if ( c == _chainmap.end() )
+            fatal("itreestream - schema " + schema + 
+                  " has no chain for " + it->first);
+          it->second.chain = c->second;
+        }
+      if ( DEBUGLEVEL > 0 ) 
+        cout << "itreestream::ctor - DATA.COUNT(" << data.size() << ")" 
+             << endl;
+      DBUG("itreestream::ctor - exit OK", 1);
+      return;
+    }
+
   // ----------------------------------------
   // Get all branches and create a data
   // structure (Field) for every leaf. For 
@@ -1155,9 +1938,171 @@ itreestream::_open(vector<string>& fname, vector<string>& tname)
   if ( DEBUGLEVEL > 0 ) 
     cout << "itreestream::ctor - DATA.COUNT(" << data.size() << ")" << endl;
 
+  _writeschema(schema);
+
   DBUG("itreestream::ctor - exit OK", 1);
 }
 
+// ------------------------------------------------------------------------
+// Find branch and leaf of a field created from a cached schema.
+// ------------------------------------------------------------------------
+void
+itreestream::_bind(Field& field)
+{
+  if ( field.leaf != 0 ) return;
+  updatefield(&field);
+}
+
+// ------------------------------------------------------------------------
+// Read cached schema. The format is
+//   treestream-schema <ROOT version>
+//   trees <count> <tree name> ...
+//   names <count> <tree name> ...
+//   fields <count>
+//   <fullname> <chain> <tree> <branch> <leaf> <iotype> <iscounter>
+//   ...
+//   branches <count>
+//   <depth> <name>
+//   ...
+// ------------------------------------------------------------------------
+bool
+itreestream::_readschema(string schema,
+                         vector<string>& tname,
+                         map<string, string>& chainnames)
+{
+  if ( schema == "" ) return false;
+
+  ifstream fin(schema.c_str());
+  if ( ! fin.good() ) return false;
+
+  string token;
+  int version = 0;
+  fin >> token >> version;
+  if ( token != "treestream-schema" || version != ROOT_VERSION_CODE )
+    return false;
+
+  int count = 0;
+  vector<string> trees;
+  fin >> token >> count;
+  if ( token != "trees" ) return false;
+  for(int i=0; i < count; i++)
+    {
+      fin >> token;
+      trees.push_back(token);
+    }
+
+  vector<string> treenames;
+  fin >> token >> count;
+  if ( token != "names" ) return false;
+  for(int i=0; i < count; i++)
+    {
+      fin >> token;
+      treenames.push_back(token);
+    }
+
+  Data fields;
+  map<string, string> chains;
+  fin >> token >> count;
+  if ( token != "fields" ) return false;
+  for(int i=0; i < count; i++)
+    {
+      Field v;
+      string chainname;
+      int iscounter = 0;
+      fin >> v.fullname >> chainname >> v.treename >> v.branchname 
+          >> v.leafname >> v.iotype >> iscounter;
+      v.iscounter = iscounter != 0;
+      fields[v.fullname] = v;
+      chains[v.fullname] = chainname;
+    }
+
+  vector<string> names;
+  vector<int> tabs;
+  fin >> token >> count;
+  if ( token != "branches" ) return false;
+  for(int i=0; i < count; i++)
+    {
+      int depth = 0;
+      fin >> depth >> token;
+      tabs.push_back(depth);
+      names.push_back(token);
+    }
+  if ( ! fin ) return false;
+
+  // Schema is complete, so use it
+
+  tname      = trees;
+  _treename  = trees[0];
+  _treenames = treenames;
+  data       = fields;
+  chainnames = chains;
+  branchname = names;
+  branchtab  = tabs;
+  return true;
+}
+
+// ------------------------------------------------------------------------
+// Write schema to cache. Write to a temporary file first so that a 
+// concurrent reader never sees an incomplete schema.
+// ------------------------------------------------------------------------
+void
+itreestream::_writeschema(string schema)
+{
+  if ( schema == "" ) return;
+
+  ostringstream tmp;
+  tmp << schema << "." << gSystem->GetPid();
+  ofstream fout(tmp.str().c_str());
+  if ( ! fout.good() )
+    {
+      warning("itreestream - unable to write schema " + schema);
+      return;
+    }
+
+  fout << "treestream-schema " << ROOT_VERSION_CODE << endl;
+
+  map<string, TChain*>::iterator c;
+  fout << "trees " << _chainmap.size();
+  fout << " " << _treename;
+  for(c=_chainmap.begin(); c != _chainmap.end(); c++)
+    if ( c->first != _treename ) fout << " " << c->first;
+  fout << endl;
+
+  fout << "names " << _treenames.size();
+  for(size_t i=0; i < _treenames.size(); i++) fout << " " << _treenames[i];
+  fout << endl;
+
+  // Fields are associated with chains by name
+
+  map<TChain*, string> chainname;
+  for(c=_chainmap.begin(); c != _chainmap.end(); c++)
+    chainname[c->second] = c->first;
+
+  fout << "fields " << data.size() << endl;
+  Data::iterator it;
+  for(it=data.begin(); it != data.end(); it++)
+    {
+      Field& field = it->second;
+      fout << field.fullname        << " " 
+           << chainname[field.chain] << " " 
+           << field.treename        << " "
+           << field.branchname      << " "
+           << field.leafname        << " "
+           << field.iotype          << " "
+           << field.iscounter       << endl;
+    }
+
+  fout << "branches " << branchname.size() << endl;
+  for(size_t i=0; i < branchname.size(); i++)
+    fout << branchtab[i] << " " << branchname[i] << endl;
+  fout.close();
+
+  if ( rename(tmp.str().c_str(), schema.c_str()) != 0 )
+    warning("itreestream - unable to write schema " + schema);
+  else
+    DBUG("itreestream::ctor - wrote schema " + schema);
+}
+
 itreestream::~itreestream()
 {
   _statuscode = kSUCCESS;
@@ -1396,8 +2341,17 @@ void
 itreestream::close()
 {
   _statuscode = kSUCCESS;
+
+  // Restore the process-wide prefetch setting changed by readahead
+
+  if ( _asyncprefetch >= 0 )
+    {
+      gEnv->SetValue("TFile.AsyncPrefetching", _asyncprefetch);
+      _asyncprefetch = -1;
+    }
   
   if ( _tree == 0 ) return;
+  if ( _trace && TRACE ) cout << tracereport();
   DBUG("itreestream::close file", 1);
   if ( _delete ) delete  _tree;
   _tree = 0;
@@ -1570,60 +2524,223 @@ itreestream::select(string namen, vector<vector<unsigned int> >& d)
   _select(namen, &d, d.size(), 'i', 2);
 }
 
+// jagged<T>
 void 
-itreestream::select(string namen)
+itreestream::select(string namen, jagged<double>& d)
 {
-  _bufmap[namen] = _index;
-  _select(namen, &_buffer[_index], 1, 'D');
-  _index++;
+  _select(namen, &d, 1, 'D', 3);
 }
 
 void 
-itreestream::select(vector<string>& namen)
+itreestream::select(string namen, jagged<float>& d)
 {
-  _bufoffset =_index;
-  _bufcount  = namen.size();
-  for(unsigned i=0; i < namen.size(); i++) select(namen[i]);
+  _select(namen, &d, 1, 'F', 3);
 }
 
-vector<double>
-itreestream::vget() 
-{ 
-  vector<double> v(_bufcount);
-  for(int i=0; i < _bufcount; i++) v[i] = _buffer[i +_bufoffset];
-  return v; 
+void 
+itreestream::select(string namen, jagged<long>& d)
+{
+  _select(namen, &d, 1, 'L', 3);
 }
 
-double
-itreestream::get(string namen) 
-{ 
-  if (_bufmap.find(namen) != _bufmap.end())
-    return _buffer[ _bufmap[namen] ];
-  else
-    return 0; 
+void 
+itreestream::select(string namen, jagged<int>& d)
+{
+  _select(namen, &d, 1, 'I', 3);
+}
+
+void 
+itreestream::select(string namen, jagged<short>& d)
+{
+  _select(namen, &d, 1, 'S', 3);
+}
+
+void 
+itreestream::select(string namen, jagged<bool>& d)
+{
+  _select(namen, &d, 1, 'O', 3);
+}
+
+void 
+itreestream::select(string namen, jagged<unsigned int>& d)
+{
+  _select(namen, &d, 1, 'i', 3);
+}
+
+void 
+itreestream::select(string namen, jagged<unsigned short>& d)
+{
+  _select(namen, &d, 1, 's', 3);
+}
+
+void 
+itreestream::select(string namen)
+{
+  _bufmap[namen] = _index;
+  _select(namen, &_buffer[_index], 1, 'D');
+  _index++;
+}
+
+void 
+itreestream::select(vector<string>& namen)
+{
+  _bufoffset =_index;
+  _bufcount  = namen.size();
+  for(unsigned i=0; i < namen.size(); i++) select(namen[i]);
+}
+
+vector<double>
+itreestream::vget() 
+{ 
+  if ( _lazy.size() > 0 ) load();
+  vector<double> v(_bufcount);
+  for(int i=0; i < _bufcount; i++) v[i] = _buffer[i +_bufoffset];
+  return v; 
+}
+
+double
+itreestream::get(string namen) 
+{ 
+  if (_bufmap.find(namen) != _bufmap.end())
+    {
+      if ( _lazy.size() > 0 ) load(namen);
+      return _buffer[ _bufmap[namen] ];
+    }
+  else
+    return 0; 
 }
 
+// ------------------------------------------------------------------------
+// Read rows starting at entry start. Each vector in v receives the values 
+// of one of the variables selected using select(name) or select(names). 
+// The values are read a basket at a time directly into the vectors.
+// ------------------------------------------------------------------------
 void
 itreestream::read(int start, vector<vector<double> >& v) 
 {
-  if ( v.size() < _bufmap.size() ) return;
+  vector<void*> arrays;
+  int nrows = getarrays(v, _bufmap.size(), arrays);
+  _readrows(start, nrows, arrays, 'D');
+}
 
-  size_t nrows = (size_t)size() < v[0].size() ? (size_t)size() : v[0].size();
-  for(size_t c=0; c < nrows; c++)
-    {      
-      int entry = start + c;
-      read(entry);
+void
+itreestream::read(int start, vector<vector<float> >& v) 
+{
+  vector<void*> arrays;
+  int nrows = getarrays(v, _bufmap.size(), arrays);
+  _readrows(start, nrows, arrays, 'F');
+}
 
-      int j=0;
-      map<string, int>::iterator it = _bufmap.begin();  
-      for(it=_bufmap.begin(); it != _bufmap.end(); it++)
-	{
-	  v[j][c] = _buffer[ it->second ];
-	  j++;
-	}
+void
+itreestream::read(int start, vector<vector<long> >& v) 
+{
+  vector<void*> arrays;
+  int nrows = getarrays(v, _bufmap.size(), arrays);
+  _readrows(start, nrows, arrays, 'L');
+}
+
+void
+itreestream::read(int start, vector<vector<int> >& v) 
+{
+  vector<void*> arrays;
+  int nrows = getarrays(v, _bufmap.size(), arrays);
+  _readrows(start, nrows, arrays, 'I');
+}
+
+void
+itreestream::_readrows(int start, int nrows, vector<void*>& arrays, 
+                       char srctype)
+{
+  _statuscode = kSUCCESS;
+  if ( nrows < 1 ) return;
+
+  // Bind arrays, in the order of the variable names, to
+  // temporary columns
+
+  vector<Column> columns;
+  map<string, int>::iterator it;
+  int c = 0;
+  for(it=_bufmap.begin(); it != _bufmap.end(); it++, c++)
+    {
+      string name_ = _fullname(it->first);
+      if ( selecteddata.find(name_) == selecteddata.end() ) continue;
+
+      Field* field = selecteddata[name_];
+      if ( field->leaf->GetLen() != 1 )
+        fatal("read - " + field->fullname + " is not a simple variable");
+
+      Column column;
+      column.field    = field;
+      column.values   = arrays[c];
+      column.capacity = nrows;
+      column.srctype  = srctype;
+      column.leaftype = getleaftype(field->leaf);
+      columns.push_back(column);
     }
+  _readcolumns(columns, start, nrows);
+}
+
+// caller-owned arrays
+
+void 
+itreestream::column(string namen, double* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'D');
+}
+
+void 
+itreestream::column(string namen, float* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'F');
+}
+
+void 
+itreestream::column(string namen, long* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'L');
+}
+
+void 
+itreestream::column(string namen, int* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'I');
+}
+
+void 
+itreestream::column(string namen, short* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'S');
+}
+
+void 
+itreestream::column(string namen, bool* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'O');
+}
+
+void 
+itreestream::column(string namen, unsigned long* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'l');
+}
+
+void 
+itreestream::column(string namen, unsigned int* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'i');
 }
 
+void 
+itreestream::column(string namen, unsigned short* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 's');
+}
+
+void 
+itreestream::column(string namen, unsigned char* values, int capacity, int* offsets)
+{
+  _column(namen, values, capacity, offsets, 'b');
+}
 
 // ------------------------------------------------------------------------
 // Read tree with ordinal value entry.
@@ -1649,7 +2766,7 @@ itreestream::read(int entry)
       
       if (localentry < 0) return localentry;
 
-      if ( DEBUGLEVEL > 0 ) 
+      if ( DEBUGENTRY && DEBUGLEVEL > 0 ) 
         cout << "entry(" << entry << ") "
              << "localentry(" << localentry << ")" << endl;
 
@@ -1670,38 +2787,536 @@ itreestream::read(int entry)
      
   // Copy data into external buffers
 
-  SelectedData::iterator it;
+  if ( _replan ) _compile();
+
+  if ( _trace )
+    for(vector<ReadStep>::iterator step=_plan.begin(); 
+        step != _plan.end(); step++)
+      traceread(&(*step), localentry);
+  else
+    for(vector<ReadStep>::iterator step=_plan.begin(); 
+        step != _plan.end(); step++)
+      {
+        step->field->branch->GetEntry(localentry);
+        if ( step->copy ) step->copy(step->field);
+      }
+
+  // Variables not read eagerly are now stale
+
+  _localentry = localentry;
+  _nread++;
+
+  return localentry; // Return ordinal value within current tree.
+}
+
+// ------------------------------------------------------------------------
+// Deferred reading
+// ------------------------------------------------------------------------
+void 
+itreestream::eager(string namen)
+{
+  _eager[_fullname(namen)] = 1;
+  _replan = true;
+}
+
+void 
+itreestream::eager(vector<string>& namen)
+{
+  for(size_t i=0; i < namen.size(); i++) eager(namen[i]);
+}
+
+void 
+itreestream::load(string namen)
+{
+  if ( _replan ) _compile();
+
+  map<string, int>::iterator it = _lazymap.find(_fullname(namen));
+  if ( it == _lazymap.end() ) return;
+  _load(it->second);
+}
+
+void 
+itreestream::load()
+{
+  if ( _replan ) _compile();
+
+  for(int step=0; step < (int)_lazy.size(); step++) _load(step);
+}
+
+void 
+itreestream::_load(int step)
+{
+  // Variable already read for current entry?
+  if ( _loaded[step] == _nread ) return;
+
+  if ( _trace )
+    traceread(&_lazy[step], _localentry);
+  else
+    {
+      Field* field = _lazy[step].field;
+      field->branch->GetEntry(_localentry);
+      if ( _lazy[step].copy ) _lazy[step].copy(field);
+    }
+  _loaded[step] = _nread;
+}
+
+// ------------------------------------------------------------------------
+// Read count entries, starting at entry start, into the caller-owned 
+// arrays.
+// ------------------------------------------------------------------------
+int
+itreestream::readcolumns(int start, int count)
+{
+  _statuscode = kSUCCESS;
+  return _readcolumns(_columns, start, count);
+}
+
+// ------------------------------------------------------------------------
+// Read count entries, starting at entry start, into the arrays bound to 
+// the given columns. The arrays are filled one column at a time for all 
+// the entries within a tree so that the baskets of each branch are read 
+// sequentially. The baskets of simple variables are read in bulk.
+// ------------------------------------------------------------------------
+int
+itreestream::_readcolumns(vector<Column>& columns, int start, int count)
+{
+  if ( _chain == 0 ) fatal("readcolumns - chain pointer is zero");
+
+  // number of values written so far to each array
+  vector<int> filled(columns.size(), 0);
+  for(size_t c=0; c < columns.size(); c++)
+    if ( columns[c].offsets ) columns[c].offsets[0] = 0;
+
+  TBufferFile buffer(TBuffer::kWrite, 10000);
+
+  int nread = 0;
+  while ( nread < count )
+    {
+      int entry = start + nread;
+      int localentry = _chain->LoadTree(entry);
+      if ( localentry < 0 ) break;
+
+      // Update pointers to tree, branches and leaves.
+
+      if ( _chain->GetTreeNumber() != _current ) _update();
+
+      for(size_t c=0; c < columns.size(); c++)
+        {
+          updatefield(columns[c].field);
+          if ( columns[c].counter ) updatefield(columns[c].counter);
+        }
+
+      // Get number of entries to be read from current tree
+
+      int nentries = (int)_chain->GetTree()->GetEntries() - localentry;
+      nentries = min(nentries, count - nread);
+
+      // Make sure that the arrays are large enough. For variable length
+      // arrays we need to read the leaf counters to find out.
+
+      for(size_t c=0; c < columns.size(); c++)
+        {
+          Column& column = columns[c];
+          if ( column.counter == 0 )
+            {
+              int len = column.field->leaf->GetLen();
+              nentries = min(nentries, (column.capacity - filled[c]) / len);
+              continue;
+            }
+
+          int total = filled[c];
+          int lenstatic = column.field->leaf->GetLenStatic();
+          for(int i=0; i < nentries; i++)
+            {
+              column.counter->branch->GetEntry(localentry + i);
+              total += (int)column.counter->leaf->GetValue() * lenstatic;
+              if ( total > column.capacity )
+                {
+                  nentries = i;
+                  break;
+                }
+            }
+        }
+
+      if ( DEBUGLEVEL > 0 )
+        cout << "readcolumns - entry(" << entry << ") "
+             << "localentry(" << localentry << ") "
+             << "entries(" << nentries << ")" << endl;
+
+      if ( nentries < 1 ) break;
+
+      // Copy data into caller's arrays, one column at a time
+
+      for(size_t c=0; c < columns.size(); c++)
+        {
+          Column& column = columns[c];
+
+          // Try to read whole baskets first. Read whatever remains, if
+          // anything, an entry at a time.
+
+          int first = readbulk(column, filled[c], localentry, nentries, 
+                               buffer);
+          filled[c] += first;
+
+          TBranch* branch = column.field->branch;
+          TLeaf* leaf     = column.field->leaf;
+          for(int i=first; i < nentries; i++)
+            {
+              branch->GetEntry(localentry + i);
+              int len = leaf->GetLen();
+              tocolumn(column, filled[c], len);
+              filled[c] += len;
+              if ( column.offsets ) column.offsets[nread + i + 1] = filled[c];
+            }
+        }
+      nread += nentries;
+    }
+  return nread;
+}
+
+// ------------------------------------------------------------------------
+// Compile the plan for reading the selected variables: a flat list of
+// fields, leaf counters first, each with the function that copies its 
+// data to the external buffer.
+// ------------------------------------------------------------------------
+void
+itreestream::_compile()
+{
+  _plan.clear();
 
   // IMPORTANT: Read leaf counters first...
 
+  SelectedData::iterator it;
   for(it=selecteddata.begin(); it != selecteddata.end(); it++)
     {
       Field* field = it->second;
       assert(field != 0);
       if ( field->skip ) continue;
       if ( ! field->iscounter ) continue;
-      readbranch(field, localentry);
+      _plan.push_back(ReadStep(field, getcopy(field)));
     }
 
-  // ..then other variables
+  // ..then other variables. If some variables are to be read eagerly,
+  // defer reading the rest until they are loaded.
 
+  _lazy.clear();
+  _lazymap.clear();
   for(it=selecteddata.begin(); it != selecteddata.end(); it++)
     {
       Field* field = it->second;
       assert(field != 0);
       if ( field->skip ) continue;
       if ( field->iscounter ) continue;
-      readbranch(field, localentry);
+      if ( _eager.size() > 0 && _eager.find(it->first) == _eager.end() )
+        {
+          _lazymap[it->first] = (int)_lazy.size();
+          _lazy.push_back(ReadStep(field, getcopy(field)));
+        }
+      else
+        _plan.push_back(ReadStep(field, getcopy(field)));
     }
+  _loaded = vector<int>(_lazy.size(), -1);
+  _replan = false;
 
-  return localentry; // Return ordinal value within current tree.
+  if ( _cachesize > 0 ) _cache();
+
+  if ( DEBUGLEVEL > 0 )
+    cout << "itreestream::_compile - steps(" << _plan.size() << ")" << endl;
+}
+
+void
+itreestream::readahead(int cachesize)
+{
+  _statuscode = kSUCCESS;
+  _cachesize  = cachesize;
+  _replan     = true;
+
+  // Prefetch asynchronously from files opened from now on. The setting
+  // is global, so remember the previous value for close to restore.
+
+  if ( _asyncprefetch < 0 )
+    _asyncprefetch = gEnv->GetValue("TFile.AsyncPrefetching", 0);
+  gEnv->SetValue("TFile.AsyncPrefetching", cachesize > 0 ? 1 : 0);
+}
+
+// ------------------------------------------------------------------------
+// Lists of entries, stored as sorted, disjoint ranges [start, stop).
+// ------------------------------------------------------------------------
+void
+itreestream::addrange(int start, int stop)
+{
+  if ( start < 0 ) start = 0;
+  if ( stop <= start ) return;
+  _ranges.push_back(pair<int, int>(start, stop));
+  mergeranges(_ranges);
+  _replan = true;
+  rewind();
 }
 
+void
+itreestream::addentries(vector<int>& entries)
+{
+  // Let mergeranges sort the entries and merge them with existing ranges
+  for(size_t i=0; i < entries.size(); i++)
+    if ( entries[i] > -1 )
+      _ranges.push_back(pair<int, int>(entries[i], entries[i]+1));
+  mergeranges(_ranges);
+  _replan = true;
+  rewind();
+}
+
+void
+itreestream::addbitmap(vector<bool>& bitmap)
+{
+  int start = -1;
+  for(int entry=0; entry < (int)bitmap.size(); entry++)
+    {
+      if ( bitmap[entry] )
+        {
+          if ( start < 0 ) start = entry;
+        }
+      else if ( start > -1 )
+        {
+          _ranges.push_back(pair<int, int>(start, entry));
+          start = -1;
+        }
+    }
+  if ( start > -1 )
+    _ranges.push_back(pair<int, int>(start, (int)bitmap.size()));
+  mergeranges(_ranges);
+  _replan = true;
+  rewind();
+}
+
+void
+itreestream::clearentries()
+{
+  _ranges.clear();
+  _replan = true;
+  rewind();
+}
+
+int
+itreestream::selectedentries()
+{
+  if ( _ranges.size() == 0 ) return entries();
+
+  int count = 0;
+  for(size_t i=0; i < _ranges.size(); i++)
+    count += _ranges[i].second - _ranges[i].first;
+  return count;
+}
+
+bool
+itreestream::readentries(string filename)
+{
+  ifstream fin(filename.c_str());
+  if ( ! fin.good() )
+    {
+      warning("itreestream - unable to read entries from " + filename);
+      return false;
+    }
+
+  // The list read replaces the current list
+  _ranges.clear();
+  int start, stop;
+  while ( fin >> start >> stop )
+    if ( start > -1 && stop > start )
+      _ranges.push_back(pair<int, int>(start, stop));
+  mergeranges(_ranges);
+  _replan = true;
+  rewind();
+  return true;
+}
+
+bool
+itreestream::writeentries(string filename)
+{
+  ofstream fout(filename.c_str());
+  if ( ! fout.good() )
+    {
+      warning("itreestream - unable to write entries to " + filename);
+      return false;
+    }
+
+  for(size_t i=0; i < _ranges.size(); i++)
+    fout << _ranges[i].first << " " << _ranges[i].second << endl;
+  return true;
+}
+
+int
+itreestream::next()
+{
+  if ( _ranges.size() > 0 )
+    {
+      if ( _range >= _ranges.size() ) return -1;
+      if ( _next < _ranges[_range].first ) _next = _ranges[_range].first;
+    }
+  else if ( _next >= entries() ) 
+    return -1;
+
+  int entry = _next;
+  if ( read(entry) < 0 ) return -1;
+
+  _next++;
+  if ( _ranges.size() > 0 && _next >= _ranges[_range].second ) _range++;
+  return entry;
+}
+
+void
+itreestream::rewind()
+{
+  _range = 0;
+  _next  = _ranges.size() > 0 ? _ranges[0].first : 0;
+}
+
+// ------------------------------------------------------------------------
+// Create a tree cache for each chain and tell it to read the baskets of
+// the selected variables only. The chains keep the cache, and its list
+// of branches, when they move from one file to the next.
+// ------------------------------------------------------------------------
+void
+itreestream::_cache()
+{
+  if ( _tree == 0 ) return;
+
+  // The cache belongs to the current file, so make sure there is one
+
+  _tree->LoadTree(_entry);
+
+  vector<TTree*> trees;
+  if ( _chainmap.size() > 0 )
+    {
+      map<string, TChain*>::iterator c;
+      for(c=_chainmap.begin(); c != _chainmap.end(); c++)
+        trees.push_back(c->second);
+    }
+  else
+    trees.push_back(_tree);
+
+  for(size_t i=0; i < trees.size(); i++)
+    {
+      trees[i]->SetCacheSize(_cachesize);
+      trees[i]->SetParallelUnzip(true);
+
+      // Do not prefetch beyond the listed entries
+      if ( _ranges.size() > 0 )
+        trees[i]->SetCacheEntryRange(_ranges.front().first, 
+                                     _ranges.back().second-1);
+    }
+
+  // Cache only the variables read eagerly. Those read on demand by load
+  // are not, so that their baskets are neither read nor unzipped ahead
+  // for entries that do not need them.
+
+  for(size_t c=0; c < _plan.size(); c++)
+    {
+      Field* field = _plan[c].field;
+      TTree* tree  = field->chain ? (TTree*)field->chain : _tree;
+      tree->AddBranchToCache(field->branchname.c_str(), true);
+    }
+
+  for(size_t i=0; i < trees.size(); i++)
+    trees[i]->StopCacheLearningPhase();
+
+  DBUG("itreestream::_cache - cache created", 1);
+}
+
+// ------------------------------------------------------------------------
+// Return number of entries. The first call counts them, which requires
+// opening every file whose number of entries is not in the index.
+// ------------------------------------------------------------------------
 int 
-itreestream::entries() { return _entries; }
+itreestream::entries() 
+{
+  if ( _entries < 0 )
+    {
+      if ( _tree == 0 ) return 0;
+
+      DBUG("itreestream::entries - GetEntries", 2);
+      _entries = _tree->GetEntries();
+
+      // Write index if one was requested but none exists
+
+      if ( _indexfile != "" && _chain != 0 )
+        {
+          ifstream fin(_indexfile.c_str());
+          if ( ! fin.good() ) writeindex(_indexfile);
+        }
+    }
+  return _entries;
+}
 
 int 
-itreestream::size()    { return _entries; }
+itreestream::size()    { return entries(); }
+
+// ------------------------------------------------------------------------
+// Write number of entries per file, one file per line:
+//   <filename> <number of entries>
+// ------------------------------------------------------------------------
+bool
+itreestream::writeindex(string indexfile)
+{
+  if ( _chain == 0 ) return false;
+
+  // Make sure entries have been counted
+  _chain->GetEntries();
+
+  ofstream fout(indexfile.c_str());
+  if ( ! fout.good() )
+    {
+      warning("itreestream - unable to write index " + indexfile);
+      return false;
+    }
+
+  Long64_t* offset = _chain->GetTreeOffset();
+  int ntrees = _chain->GetNtrees();
+  for(int i=0; i < ntrees && i < (int)filepath.size(); i++)
+    fout << filepath[i] << " " << offset[i+1] - offset[i] << endl;
+  fout.close();
+
+  DBUG("itreestream::writeindex - " + indexfile);
+  return true;
+}
+
+// ------------------------------------------------------------------------
+// Get number of entries for each file from index, if any.
+// Files not in the index are left untouched.
+// ------------------------------------------------------------------------
+void
+itreestream::_readindex(vector<Long64_t>& nentries)
+{
+  if ( _indexfile == "" ) return;
+
+  ifstream fin(_indexfile.c_str());
+  if ( ! fin.good() ) return;
+
+  map<string, Long64_t> index;
+  string fname;
+  Long64_t n;
+  while ( fin >> fname >> n ) index[fname] = n;
+  fin.close();
+
+  Long64_t total = 0;
+  bool complete = true;
+  for(size_t i=0; i < filepath.size(); i++)
+    {
+      map<string, Long64_t>::iterator it = index.find(filepath[i]);
+      if ( it == index.end() || it->second < 1 )
+        {
+          complete = false;
+          continue;
+        }
+      nentries[i] = it->second;
+      total += it->second;
+    }
+
+  // If we know the number of entries in every file, then we know the
+  // number of entries in the chain
+  if ( complete ) _entries = total;
+
+  DBUG("itreestream::_readindex - " + _indexfile);
+}
 
 string
 itreestream::name() { return _tree ? _tree->GetName() : ""; }
@@ -1727,13 +3342,27 @@ itreestream::tree() { return _tree; }
 TFile*
 itreestream::file() { return ((TChain*)(_tree))->GetFile(); }
 
+void
+itreestream::trace(bool on)
+{
+  _statuscode = kSUCCESS;
+  _trace = on;
+}
+
+string
+itreestream::tracereport()
+{
+  return ::tracereport(selecteddata);
+}
+
 string
 itreestream::str() const
 {
   if ( ! _tree ) return string("");
 
   ostringstream out;
-  out << "File " << _tree->GetCurrentFile()->GetName()      << endl;
+  if ( _tree->GetCurrentFile() )
+    out << "File " << _tree->GetCurrentFile()->GetName()      << endl;
   out << "Tree   " << _tree->GetName()      << endl;
   TList* list = _tree->GetListOfFriends();
   if ( list )
@@ -1751,7 +3380,8 @@ itreestream::str() const
   int count = 0;
   for(it=data.begin(); it != data.end(); it++)
     {
-      const Field& field = it->second;
+      Field field = it->second;
+      if ( field.leaf == 0 ) updatefield(&field);
       count++;
       int maxcount = 0;
       TLeaf* leafcounter = field.leaf->GetLeafCounter(maxcount);
@@ -1796,6 +3426,23 @@ itreestream::str() const
   return out.str();
 }
 
+// ------------------------------------------------------------------------
+// If the given name does not specify a tree name, then default to the 
+// name of the first tree.
+// ------------------------------------------------------------------------
+string
+itreestream::_fullname(string namen)
+{
+  for(size_t i=0; i < _treenames.size(); i++)
+    {
+      DBUG(string("_fullname - treename( ") + _treenames[i] + string(" )"));
+      string key = _treenames[i] + string("/");
+      if ( namen.find(key) != std::string::npos ) return namen;
+    }
+  DBUG("_fullname - WARNING - treename not specified - use: " + _treename);
+  return _treename + "/" + namen;
+}
+
 // ------------------------------------------------------------------------
 // The following routine is used to specify the addresses into which data
 // are to be read, when reading a Root-file
@@ -1814,24 +3461,9 @@ itreestream::_select(string namen, void* address, int maxsize, char srctype,
                      int isvector)
 {
   _statuscode = kSUCCESS;
+  _replan = true;
   
-  // If namen does not specify a tree name, then  default to first tree name
-  bool treename_specified = false;
-  for(size_t i=0; i < _treenames.size(); i++)
-    {
-      DBUG(string("_select - treename( ") + _treenames[i] + string(" )"));
-      string key = _treenames[i] + string("/");
-      if ( namen.find(key) != std::string::npos )
-	{
-	  treename_specified = true;
-	  break;
-	}
-    }
-  if ( ! treename_specified )
-    {
-      namen = _treename + "/" + namen;
-      DBUG("_select - WARNING - treename not specified - use: " + _treename);
-    }
+  namen = _fullname(namen);
 
   // If variable has already been selected, just update its address and
   // source type, otherwise get the branch and leaf.
@@ -1858,10 +3490,19 @@ itreestream::_select(string namen, void* address, int maxsize, char srctype,
       // Known branch - activate it
 
       Field& field  = data[namen]; // NB: Get a reference, not a copy!
+      _bind(field);
+      if ( isvector == 3 && field.iotype == 'v' )
+        {
+          warning("itreestream - jagged array not available for "
+                  "STL vector " + namen);
+          _statuscode = kBADBRANCH;
+          return;
+        }
       field.srctype = srctype;
       field.maxsize = maxsize;
       field.address = address;     // source address
       field.isvector= isvector;
+      field.leaftype= getleaftype(field.leaf);
       selecteddata[namen] = &field;
 
       // If this branch has a branch counter, select its branch unless
@@ -1900,6 +3541,7 @@ itreestream::_select(string namen, void* address, int maxsize, char srctype,
               f.srctype = 'I';          // Default source type
               f.maxsize = 1;
               f.iscounter = true;
+              f.leaftype= getleaftype(f.leaf);
               selecteddata[name_] = &f;
             }
         }
@@ -1911,6 +3553,81 @@ itreestream::_select(string namen, void* address, int maxsize, char srctype,
     }
 }  
 
+// ------------------------------------------------------------------------
+// Bind a caller-owned array to a variable. Variable length arrays
+// need an offsets array as well as their leaf counter, which is read to
+// determine how many values each entry holds.
+// ------------------------------------------------------------------------
+void 
+itreestream::_column(string namen, void* values, int capacity, int* offsets,
+                     char srctype)
+{
+  _statuscode = kSUCCESS;
+
+  namen = _fullname(namen);
+  if ( data.find(namen) == data.end() )
+    {
+      warning("itreestream - branch " + namen + " not found");
+      _statuscode = kBADBRANCH;
+      return;
+    }
+  if ( values == 0 || capacity < 1 )
+    fatal("column - array for " + namen + " is of zero length!");
+
+  Field& field = data[namen]; // NB: Get a reference, not a copy!
+  _bind(field);
+  if ( field.iotype == 'v' )
+    {
+      warning("itreestream - column not available for STL vector " + namen);
+      _statuscode = kBADBRANCH;
+      return;
+    }
+
+  Column column;
+  column.field    = &field;
+  column.values   = values;
+  column.offsets  = offsets;
+  column.capacity = capacity;
+  column.srctype  = srctype;
+  column.leaftype = getleaftype(field.leaf);
+
+  int count = 0;
+  TLeaf* leafcounter = field.leaf->GetLeafCounter(count);
+  if ( leafcounter != 0 )
+    {
+      if ( offsets == 0 )
+        {
+          warning("itreestream - offsets array needed for " + namen);
+          _statuscode = kBADBRANCH;
+          return;
+        }
+
+      TBranch* branch = leafcounter->GetBranch();
+      string name_(string(branch->GetTree()->GetName()) +
+                   "/" + string(branch->GetName()));
+      if ( data.find(name_) == data.end() ) _getleaf(branch);
+      column.counter = &data[name_];
+    }
+
+  if ( DEBUGLEVEL > 0 )
+    cout << "_column - " << namen << "\t" 
+         << " values: " << values
+         << " capacity: " << capacity
+         << " srctype: " << srctype
+         << " leaftype: " << column.leaftype
+         << endl;
+
+  // If variable has already been bound, just update its array
+
+  for(size_t c=0; c < _columns.size(); c++)
+    if ( _columns[c].field == column.field )
+      {
+        _columns[c] = column;
+        return;
+      }
+  _columns.push_back(column);
+}
+
 // ------------------------------------------------------------------------
 // Update the branch and leaf pointers. We do this when we switch from one 
 // tree, or trees, to another in a chain of Root-files.
@@ -1928,22 +3645,7 @@ itreestream::_update()
   for(it=selecteddata.begin(); it != selecteddata.end(); it++)
     {
       Field* field = it->second;
-      if ( field == 0 )  fatal("update - zero field pointer");
-
-      if ( field->chain == 0 ) fatal("update - zero field->chain pointer");
-      
-      field->branch = field->chain->GetBranch(field->branchname.c_str());
-      if ( field->branch == 0 )
-        { 
-          fatal("update - pointer is zero for tree/branch (" 
-                  + field->fullname + ")");
-          field->branch = 0;
-          field->leaf   = 0;
-          continue;
-        }
-      field->leaf = field->branch->GetLeaf(field->leafname.c_str());
-      if ( field->leaf == 0 ) fatal("update - pointer is zero for leaf "
-                             + field->leafname);
+      updatefield(field);
 
       // Let Root handle types that are stored as STL vectors
       if ( field->iotype == 'v')
@@ -2083,6 +3785,7 @@ itreestream::_update()
         fatal("_update - external buffer for " 
               + field->fullname + " is of zero length!");
     }
+
   DBUG("\tdone updating branch pointers", 1);
 }
 
@@ -2090,7 +3793,10 @@ int
 itreestream::maximum(string name_)
 {
   if ( data.find(name_) != data.end() )
-    return getmaxsize(data[name_].leaf);
+    {
+      _bind(data[name_]);
+      return getmaxsize(data[name_].leaf);
+    }
   else
     return 1;
 }
@@ -2116,6 +3822,111 @@ std::ostream& operator<<(std::ostream& os, const itreestream& tuple)
   return os;
 }
 
+// ------------------------------------------------------------------------
+// Fill a tree in a background thread. Each entry saved is a copy, in a
+// slot, of the buffers of all the branches of the tree. The writer copies
+// the oldest slot into its own branch buffers and fills the tree.
+// ------------------------------------------------------------------------
+struct BackgroundWriter
+{
+  BackgroundWriter(otreestream* stream_, int queuesize_)
+  : stream(stream_),
+    queuesize(max(queuesize_, 1)),
+    done(false),
+    busy(false)
+  {}
+
+  otreestream* stream;
+  size_t  queuesize;
+  bool    done;
+  bool    busy;               /// true while an entry is being written
+
+  vector<char*>  sources;     /// Buffers written by store
+  vector<size_t> offsets;     /// Offset of each buffer within a slot
+  vector<size_t> sizes;       /// Size of each buffer in bytes
+  vector<char>   buffer;      /// Buffers from which the tree is filled
+
+  deque<vector<char> > queue; /// Entries waiting to be written
+  vector<vector<char> > spare;/// Slots that can be reused
+
+  mutex mutex_;
+  condition_variable notfull;
+  condition_variable notempty;
+  condition_variable drained;
+  thread worker;
+
+  // Copy current entry into queue. Wait if the queue is full.
+  void push()
+  {
+    vector<char> slot;
+    {
+      unique_lock<mutex> lock(mutex_);
+      notfull.wait(lock, [this]{ return queue.size() < queuesize; });
+      if ( spare.size() > 0 )
+        {
+          slot.swap(spare.back());
+          spare.pop_back();
+        }
+    }
+    slot.resize(buffer.size());
+    for(size_t i=0; i < sources.size(); i++)
+      memcpy(&slot[offsets[i]], sources[i], sizes[i]);
+    {
+      unique_lock<mutex> lock(mutex_);
+      queue.push_back(vector<char>());
+      queue.back().swap(slot);
+    }
+    notempty.notify_one();
+  }
+
+  // Write entries until told to stop and the queue is empty
+  void run()
+  {
+    while ( true )
+      {
+        vector<char> slot;
+        {
+          unique_lock<mutex> lock(mutex_);
+          notempty.wait(lock, [this]{ return done || queue.size() > 0; });
+          if ( queue.size() == 0 ) return;
+          slot.swap(queue.front());
+          queue.pop_front();
+          busy = true;
+        }
+        notfull.notify_one();
+
+        memcpy(&buffer[0], &slot[0], buffer.size());
+        stream->_fill();
+
+        {
+          unique_lock<mutex> lock(mutex_);
+          spare.push_back(vector<char>());
+          spare.back().swap(slot);
+          busy = false;
+        }
+        drained.notify_all();
+      }
+  }
+
+  // Wait until all queued entries have been written
+  void drain()
+  {
+    unique_lock<mutex> lock(mutex_);
+    drained.wait(lock, [this]{ return queue.size() == 0 && ! busy; });
+  }
+
+  // Write queued entries and stop
+  void stop()
+  {
+    {
+      unique_lock<mutex> lock(mutex_);
+      done = true;
+    }
+    notempty.notify_one();
+    if ( worker.joinable() ) worker.join();
+  }
+};
+
 // ------------------------------------------------------------------------
 // W R I T E
 // ------------------------------------------------------------------------
@@ -2123,7 +3934,19 @@ otreestream::otreestream()
   : _file(0),
     _tree(0),
     _statuscode(kSUCCESS),
-    _entries(0)
+    _entries(0),
+    _plan(vector<StoreStep>()),
+    _replan(true),
+    _writer(0),
+    _maxentries(0),
+    _maxbytes(0),
+    _fileentries(0),
+    _filenames(vector<string>()),
+    _source(0),
+    _sourcetree(-1),
+    _sourcebranches(vector<TBranch*>()),
+    _trace(TRACE),
+    _ownfile(false)
 {}
 
 otreestream::otreestream(std::string filename, 
@@ -2137,7 +3960,19 @@ otreestream::otreestream(std::string filename,
     _entries(0),
     _idatabuf(0),
     _databuf(vector<double>(bufsize)),
-    _autosavecount(-1)
+    _autosavecount(-1),
+    _plan(vector<StoreStep>()),
+    _replan(true),
+    _writer(0),
+    _maxentries(0),
+    _maxbytes(0),
+    _fileentries(0),
+    _filenames(vector<string>()),
+    _source(0),
+    _sourcetree(-1),
+    _sourcebranches(vector<TBranch*>()),
+    _trace(TRACE),
+    _ownfile(true)
 {
   DBUG("create file "+filename,1);
 
@@ -2172,7 +4007,19 @@ otreestream::otreestream(TFile* file_,
     _entries(0),
     _idatabuf(0),
     _databuf(vector<double>(bufsize)),
-    _autosavecount(-1)
+    _autosavecount(-1),
+    _plan(vector<StoreStep>()),
+    _replan(true),
+    _writer(0),
+    _maxentries(0),
+    _maxbytes(0),
+    _fileentries(0),
+    _filenames(vector<string>()),
+    _source(0),
+    _sourcetree(-1),
+    _sourcebranches(vector<TBranch*>()),
+    _trace(TRACE),
+    _ownfile(false)
 {
   if ( ! _file )
     {
@@ -2193,6 +4040,86 @@ otreestream::otreestream(TFile* file_,
     }
 }
 
+otreestream::otreestream(std::string filename, 
+                         itreestream& stream,
+                         std::string namen,
+                         int complevel,
+                         int bufsize)
+  : _file(0),
+    _tree(0),
+    _statuscode(kSUCCESS),
+    _entries(0),
+    _idatabuf(0),
+    _databuf(vector<double>(bufsize)),
+    _autosavecount(-1),
+    _plan(vector<StoreStep>()),
+    _replan(true),
+    _writer(0),
+    _maxentries(0),
+    _maxbytes(0),
+    _fileentries(0),
+    _filenames(vector<string>()),
+    _source(&stream),
+    _sourcetree(-1),
+    _sourcebranches(vector<TBranch*>()),
+    _trace(TRACE),
+    _ownfile(true)
+{
+  DBUG("create skim file "+filename,1);
+
+  TChain* chain = stream._chain;
+  if ( chain == 0 ) fatal("otreestream - input stream has no chain");
+  if ( chain->LoadTree(max(stream._entry, 0)) < 0 )
+    fatal("otreestream - unable to load input tree");
+
+  _file = TFile::Open(filename.c_str(), "RECREATE");
+  if ( ! _file )
+    {
+      cerr << "otreestream **Error** unable to open " << filename << endl;
+      _statuscode = kBADOPEN;
+      return;
+    }
+  _file->SetCompressionLevel(complevel);
+  _file->cd();
+
+  // Clone structure of the requested branches only. The clone shares the
+  // branch buffers of the input tree.
+
+  vector<string> names;
+  split(namen, names);
+  if ( names.size() == 0 ) names.push_back("*");
+
+  chain->SetBranchStatus("*", 0);
+  for(size_t i=0; i < names.size(); i++)
+    chain->SetBranchStatus(names[i].c_str(), 1);
+
+  // Keep the leaf counter of each selected variable length array
+
+  TTree* tree_ = chain->GetTree();
+  TObjArray* leaves = tree_->GetListOfLeaves();
+  for(int i=0; i < leaves->GetEntries(); i++)
+    {
+      TLeaf* leaf = (TLeaf*)((*leaves)[i]);
+      if ( ! tree_->GetBranchStatus(leaf->GetBranch()->GetName()) ) continue;
+
+      int count = 0;
+      TLeaf* counter = leaf->GetLeafCounter(count);
+      if ( counter ) 
+        chain->SetBranchStatus(counter->GetBranch()->GetName(), 1);
+    }
+  _tree = chain->CloneTree(0);
+  chain->SetBranchStatus("*", 1);
+
+  if ( ! _tree )
+    {
+      cerr << "otreestream **Error** can't clone tree " 
+           << chain->GetName() << endl;
+      _statuscode = kBADTREE;
+      return;
+    }
+  _tree->SetDirectory(_file);
+}
+
 otreestream::~otreestream()
 {
   _statuscode = kSUCCESS;
@@ -2206,7 +4133,18 @@ otreestream::close(bool closefile)
 
   if ( _file == 0 ) return;
   if ( _tree == 0 ) return;
+
+  // Wait until all entries have been written
+
+  if ( _writer )
+    {
+      _writer->stop();
+      delete _writer;
+      _writer = 0;
+    }
   
+  if ( _trace && TRACE ) cout << tracereport();
+
   DBUG("otreestream::close file (before)", 1);
 
   SelectedData::iterator it = selecteddata.begin();
@@ -2218,7 +4156,8 @@ otreestream::close(bool closefile)
     }
   DBUG("otreestream::close file (after)", 1);
 
-  if ( closefile )
+  // Files opened by rollover are always closed
+  if ( closefile || _filenames.size() > 1 )
     {
       _file->Write(0, TObject::kOverwrite); //kWriteDelete
       //_file->Close(); // causes a crash in ROOT
@@ -2375,207 +4314,681 @@ otreestream::add(string namen, vector<vector<float>>& d)
 }
 
 void 
-otreestream::add(string namen, vector<vector<long>>& d)
+otreestream::add(string namen, vector<vector<long>>& d)
+{
+  _add(namen, &d, d.size(), 'L', 'L', true);
+}
+
+void 
+otreestream::add(string namen, vector<vector<int>>& d)
+{
+  _add(namen, &d, d.size(), 'I', 'I', true);
+}
+
+void 
+otreestream::add(string namen, vector<vector<short>>& d)
+{
+  _add(namen, &d, d.size(), 'S', 'S', true);
+}
+
+void 
+otreestream::add(string namen, vector<vector<bool>>& d)
+{
+  _add(namen, &d, d.size(), 'O', 'O', true);
+}
+
+void 
+otreestream::add(string namen, vector<vector<unsigned int>>& d)
+{
+  _add(namen, &d, d.size(), 'i', 'i', true);
+}
+
+void 
+otreestream::add(string namen, vector<vector<unsigned short>>& d)
+{
+  _add(namen, &d, d.size(), 's', 's', true);
+}
+
+
+void 
+otreestream::add(string namen, vector<vector<string>>& d)
+{
+  _add(namen, &d, d.size(), 'C', 'C', true);
+}
+
+
+// Jagged arrays
+
+void 
+otreestream::add(string namen, jagged<double>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'D', 'D', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<float>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'F', 'F', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<long>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'L', 'L', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<int>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'I', 'I', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<short>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'S', 'S', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<bool>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'O', 'O', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<unsigned int>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 'i', 'i', 3);
+}
+
+void 
+otreestream::add(string namen, jagged<unsigned short>& d, int maxsize)
+{
+  _add(namen, &d, maxsize, 's', 's', 3);
+}
+
+
+void 
+otreestream::add(string namen)
+{
+  if ( (unsigned)_idatabuf >= _databuf.size() )
+    {
+      cout << "You need to increase internal buffer size" << endl;
+      cout << "It is currently set to " << _databuf.size() << endl;
+      exit(0);
+    }
+  _add(namen, &_databuf[_idatabuf], 1, 'D', 'D');
+  _idatabuf++;
+}
+
+// ------------------------------------------------------------------------
+// Copy each variable from external buffer to internal buffer, taking 
+// care of type conversions. Then store data away.
+// ------------------------------------------------------------------------
+void
+otreestream::insert(vector<double>& data) 
+{ 
+  copy(data.begin(), data.end(), _databuf.begin());
+}
+
+void
+otreestream::store() 
+{ 
+  if ( DEBUGENTRY && DEBUGLEVEL > 0 ) cout << "BEGIN store" << endl;
+  _statuscode = kSUCCESS;
+  _entry = _entries;
+
+  if ( _replan ) _compile();
+
+  if ( _trace )
+    for(vector<StoreStep>::iterator step=_plan.begin(); 
+        step != _plan.end(); step++)
+      tracestore(&(*step));
+  else
+    for(vector<StoreStep>::iterator step=_plan.begin(); 
+        step != _plan.end(); step++)
+      storestep(&(*step));
+
+  if ( DEBUGENTRY && DEBUGLEVEL > 0 ) cout << "END store" << endl << endl;
+}
+
+// ------------------------------------------------------------------------
+// Compile the plan for storing the variables. The leaf counter of each 
+// variable, and the functions that get the size of its external buffer 
+// and copy it, are found once here rather than for every entry.
+// ------------------------------------------------------------------------
+void
+otreestream::_compile()
+{
+  _plan.clear();
+
+  SelectedData::iterator it;
+  for(it = selecteddata.begin(); it != selecteddata.end(); it++)
+    {
+      Field* field  = it->second;
+      assert(field);
+      assert(field->leaf);
+
+      // Variables bound to columns are stored by writecolumns
+      if ( field->skip ) continue;
+
+      // if this is a leaf counter; apparently, need to store explicitly 
+      // (Root v6.16/00)
+      if ( field->iscounter )
+        {
+          _plan.push_back(StoreStep(field, 0, 0, getstore(field)));
+          continue;
+        }
+
+      // Find leaf counter, if any
+      Field* counter = 0;
+      int flag = 0;
+      TLeaf* leafcounter = field->leaf->GetLeafCounter(flag);
+      if ( leafcounter != 0 )
+	{
+	  string name_(leafcounter->GetName());
+	  if ( DEBUGLEVEL > 0 )
+	    cout << "\tfound leaf counter( " << name_ << " )"
+		 << "\tfor " << field->leaf->GetName() << endl;
+	  if ( selecteddata.find(name_) != selecteddata.end() )
+	    counter = selecteddata[name_];
+	  else
+	    fatal("no selectedata structure for leaf count " + name_);
+	}
+
+      // The size of a scalar is fixed
+      SizeFunction size = getsize(field);
+      if ( size == 0 ) field->size = min(1, field->maxsize);
+
+      _plan.push_back(StoreStep(field, counter, size, getstore(field)));
+    }
+  _replan = false;
+
+  if ( DEBUGLEVEL > 0 )
+    cout << "otreestream::_compile - steps(" << _plan.size() << ")" << endl;
+}
+
+void
+otreestream::save()
+{
+  // ..and store away.
+
+  if ( _source ) _readsource();
+
+  if ( _writer )
+    _writer->push();
+  else
+    _fill();
+  _entries++;
+  _fileentries++;
+
+  // If the current file is full, continue in a new one. The rollover is
+  // done here, in the caller's thread, rather than in _fill, which may 
+  // run in the thread of the background writer. With a background 
+  // writer, the size of the file is checked only after the queue has 
+  // been drained, every queuesize entries.
+
+  if ( _maxentries > 0 )
+    {
+      bool full = _fileentries >= _maxentries;
+      if ( ! full && _maxbytes > 0 )
+        {
+          if ( _writer == 0 )
+            full = _file->GetEND() >= _maxbytes;
+          else if ( _fileentries % _writer->queuesize == 0 )
+            {
+              _writer->drain();
+              full = _file->GetEND() >= _maxbytes;
+            }
+        }
+      if ( full ) _rollover();
+    }
+
+  //   // Save header every _autosavecount events
+  //   if ( _entries % _autosavecount == 0 )
+  //     {
+  //       cout << _entries << "\totreestream::commit is saving header" << endl;
+  //       _tree->AutoSave("SaveSelf");
+  //     }
+}
+
+// ------------------------------------------------------------------------
+// Fill tree. Note: this may be called by the background writer.
+// ------------------------------------------------------------------------
+void
+otreestream::_fill()
+{
+  _file->cd();
+  _tree->Fill();
+}
+
+void
+otreestream::rollover(int maxentries, int maxMbytes)
+{
+  _statuscode  = kSUCCESS;
+  _maxentries  = maxentries;
+  _maxbytes    = (Long64_t)maxMbytes * 1000000;
+
+  // A size limit alone is allowed
+  if ( _maxentries < 1 && _maxbytes > 0 ) _maxentries = 2000000000;
+
+  if ( _filenames.size() == 0 && _file != 0 )
+    _filenames.push_back(_file->GetName());
+}
+
+void
+otreestream::_rollover()
+{
+  // Name of next file: <name>_<number>.root
+
+  string stem(_filenames[0]);
+  int k = stem.rfind(".root");
+  if ( k > 0 ) stem = stem.substr(0, k);
+  char filename[1024];
+  sprintf(filename, "%s_%4.4d.root", stem.c_str(), (int)_filenames.size());
+
+  DBUG("otreestream::rollover - " + string(filename), 1);
+
+  // Write all queued entries to the current file
+
+  if ( _writer ) _writer->drain();
+
+  TFile* file_ = TFile::Open(filename, "RECREATE");
+  if ( ! file_ ) fatal("rollover - unable to open " + string(filename));
+  file_->SetCompressionSettings(_file->GetCompressionSettings());
+
+  // Copy structure of tree, including branch addresses, to new file
+
+  file_->cd();
+  TTree* tree_ = _tree->CloneTree(0);
+  if ( ! tree_ ) fatal("rollover - unable to clone tree");
+  tree_->SetDirectory(file_);
+
+  // Deleting the current tree resets the branch addresses of its clone,
+  // so remember them
+
+  vector<pair<string, char*> > addresses;
+  TObjArray* array = _tree->GetListOfBranches();
+  for(int i=0; i < array->GetEntries(); i++)
+    {
+      TBranch* branch = (TBranch*)((*array)[i]);
+      addresses.push_back(pair<string, char*>(branch->GetName(), 
+                                              branch->GetAddress()));
+    }
+
+  // Close current file, which deletes its tree. However, do not close a 
+  // file the caller gave us.
+
+  _file->cd();
+  if ( _ownfile )
+    {
+      _file->Write(0, TObject::kOverwrite);
+      delete _file;
+    }
+  else
+    {
+      _tree->Write(0, TObject::kOverwrite);
+      delete _tree;
+    }
+
+  _file = file_;
+  _tree = tree_;
+  _ownfile = true;
+  _fileentries = 0;
+  _filenames.push_back(filename);
+  if ( _source ) _sourcetree = -1;
+
+  for(size_t i=0; i < addresses.size(); i++)
+    {
+      TBranch* branch = _tree->GetBranch(addresses[i].first.c_str());
+      if ( branch == 0 ) 
+        fatal("rollover - unable to find branch " + addresses[i].first);
+      branch->SetAddress(addresses[i].second);
+    }
+
+  // Update pointers to branches and leaves
+
+  SelectedData::iterator it;
+  for(it = selecteddata.begin(); it != selecteddata.end(); it++)
+    {
+      Field* field  = it->second;
+      field->branch = _tree->GetBranch(field->branchname.c_str());
+      if ( field->branch == 0 ) 
+        fatal("rollover - unable to find branch " + field->branchname);
+      field->leaf   = field->branch->GetLeaf(field->branchname.c_str());
+      if ( field->leaf == 0 ) 
+        fatal("rollover - unable to find leaf " + field->branchname);
+    }
+}
+
+// ------------------------------------------------------------------------
+// Read the branches of the skim for the entry last read by the input 
+// stream. The branch buffers of the input tree are those of the output 
+// tree, so there is nothing to copy.
+// ------------------------------------------------------------------------
+void
+otreestream::_readsource()
+{
+  TChain* chain = _source->_chain;
+  if ( chain->GetTreeNumber() != _sourcetree )
+    {
+      // New input file, so point output branches to its buffers
+      TTree* tree_ = chain->GetTree();
+      tree_->CopyAddresses(_tree);
+
+      _sourcebranches.clear();
+      TObjArray* array = _tree->GetListOfBranches();
+      for(int i=0; i < array->GetEntries(); i++)
+        {
+          string name_(((TBranch*)((*array)[i]))->GetName());
+          if ( selecteddata.find(name_) != selecteddata.end() ) continue;
+
+          TBranch* branch = tree_->GetBranch(name_.c_str());
+          if ( branch == 0 ) 
+            fatal("otreestream - input branch " + name_ + " not found");
+          _sourcebranches.push_back(branch);
+        }
+      _sourcetree = chain->GetTreeNumber();
+    }
+
+  for(size_t i=0; i < _sourcebranches.size(); i++)
+    _sourcebranches[i]->GetEntry(_source->_localentry);
+}
+
+vector<string>
+otreestream::filenames() 
+{ 
+  if ( _filenames.size() == 0 && _file != 0 ) 
+    return vector<string>(1, _file->GetName());
+  return _filenames; 
+}
+
+void
+otreestream::commit()
+{
+  store();
+  save();
+}
+
+// ------------------------------------------------------------------------
+// Caller-owned arrays, each holding the values of a variable for many 
+// entries
+// ------------------------------------------------------------------------
+void 
+otreestream::column(string namen, double* values, int maxsize, int* offsets)
+{
+  _column(namen, values, maxsize, offsets, 'D');
+}
+
+void 
+otreestream::column(string namen, float* values, int maxsize, int* offsets)
 {
-  _add(namen, &d, d.size(), 'L', 'L', true);
+  _column(namen, values, maxsize, offsets, 'F');
 }
 
 void 
-otreestream::add(string namen, vector<vector<int>>& d)
+otreestream::column(string namen, long* values, int maxsize, int* offsets)
 {
-  _add(namen, &d, d.size(), 'I', 'I', true);
+  _column(namen, values, maxsize, offsets, 'L');
 }
 
 void 
-otreestream::add(string namen, vector<vector<short>>& d)
+otreestream::column(string namen, int* values, int maxsize, int* offsets)
 {
-  _add(namen, &d, d.size(), 'S', 'S', true);
+  _column(namen, values, maxsize, offsets, 'I');
 }
 
 void 
-otreestream::add(string namen, vector<vector<bool>>& d)
+otreestream::column(string namen, short* values, int maxsize, int* offsets)
 {
-  _add(namen, &d, d.size(), 'O', 'O', true);
+  _column(namen, values, maxsize, offsets, 'S');
 }
 
 void 
-otreestream::add(string namen, vector<vector<unsigned int>>& d)
+otreestream::column(string namen, bool* values, int maxsize, int* offsets)
 {
-  _add(namen, &d, d.size(), 'i', 'i', true);
+  _column(namen, values, maxsize, offsets, 'O');
 }
 
 void 
-otreestream::add(string namen, vector<vector<unsigned short>>& d)
+otreestream::column(string namen, unsigned int* values, int maxsize, 
+                    int* offsets)
 {
-  _add(namen, &d, d.size(), 's', 's', true);
+  _column(namen, values, maxsize, offsets, 'i');
 }
 
-
 void 
-otreestream::add(string namen, vector<vector<string>>& d)
+otreestream::column(string namen, unsigned short* values, int maxsize, 
+                    int* offsets)
 {
-  _add(namen, &d, d.size(), 'C', 'C', true);
+  _column(namen, values, maxsize, offsets, 's');
 }
 
-
-void 
-otreestream::add(string namen)
+void
+otreestream::column(string namen, unsigned long* values, int maxsize, 
+                    int* offsets)
 {
-  if ( (unsigned)_idatabuf >= _databuf.size() )
-    {
-      cout << "You need to increase internal buffer size" << endl;
-      cout << "It is currently set to " << _databuf.size() << endl;
-      exit(0);
-    }
-  _add(namen, &_databuf[_idatabuf], 1, 'D', 'D');
-  _idatabuf++;
+  _column(namen, values, maxsize, offsets, 'l');
 }
 
-// ------------------------------------------------------------------------
-// Copy each variable from external buffer to internal buffer, taking 
-// care of type conversions. Then store data away.
-// ------------------------------------------------------------------------
 void
-otreestream::insert(vector<double>& data) 
-{ 
-  copy(data.begin(), data.end(), _databuf.begin());
+otreestream::column(string namen, unsigned char* values, int maxsize, 
+                    int* offsets)
+{
+  _column(namen, values, maxsize, offsets, 'b');
 }
 
 void
-otreestream::store() 
-{ 
-  DBUG("BEGIN store");
+otreestream::_column(string namen, void* values, int maxsize, int* offsets,
+                     char srctype)
+{
   _statuscode = kSUCCESS;
-  _entry = _entries;
-
-  map<string, int> counter;
+  if ( values == 0 || maxsize < 1 )
+    fatal("column - array for " + namen + " is of zero length!");
 
-  SelectedData::iterator it;
+  // A fixed length array is named <name>[<length>]; otherwise, an array
+  // is of variable length
 
-  for(it = selecteddata.begin(); it != selecteddata.end(); it++)
+  int isvector = maxsize > 1;
+  int k = namen.rfind("[");
+  if ( k > -1 )
     {
-      Field* field  = it->second;
-      assert(field);
-      assert(field->leaf);
+      string length = namen.substr(k+1, namen.rfind("]")-k-1);
+      if ( length != "" && 
+           length.find_first_not_of("0123456789") == string::npos )
+        {
+          if ( atoi(length.c_str()) != maxsize )
+            fatal("column - length of " + namen + " is not maxsize");
+          isvector = 0;
+        }
+    }
 
-      if ( DEBUGLEVEL > 0 )
-	cout << "commit( " + string(field->leaf->GetName()) << " )" << endl;
+  // Create branch, and leaf counter if needed, as for add
+  _add(namen, values, maxsize, srctype, srctype, isvector);
 
-      // if this is a leaf counter; apparently, need to store explicitly (Root v6.16/00)
-      if ( field->iscounter )
-	{
-	  fromexternal<int>(field);
-	  continue;
-	}
-      
-      // Ok, get the count for this variable.
-      int len = getexsize(field);
-      if ( DEBUGLEVEL > 0 )
-	cout << "\tcommit size: " << len 
-	     << "\tfield->maxsize: " << field->maxsize << endl;
-      
-      field->size = min(len, field->maxsize); // update count
+  string name_(namen.substr(0, namen.find("/")));
+  name_ = name_.substr(0, name_.rfind("["));
+  Field* field = selecteddata[name_];
 
-      if ( DEBUGLEVEL > 0 )
-	cout << "\tfield->size: " << field->size << endl;      
-      
-      // If the variable has a leafcounter update size field of the leaf counter
-      int flag = 0;
-      TLeaf* leafcounter = field->leaf->GetLeafCounter(flag);
-      if ( leafcounter != 0 )
-	{
-	  string name_(leafcounter->GetName());
-	  if ( DEBUGLEVEL > 0 )
-	    cout << "\tfound leaf counter( " << name_ << " ) size: " << field->size
-		 << "\tfor " << field->leaf->GetName() << endl;
-	  if ( selecteddata.find(name_) != selecteddata.end() )
-	    selecteddata[name_]->size = field->size;
-	  else
-	    fatal("no selectedata structure for leaf count " + name_);
-	}
-       
+  // Rebinding a column?
+  for(size_t c=0; c < _columns.size(); c++)
+    if ( _columns[c].field == field ) 
+      {
+        _columns[c].values  = values;
+        _columns[c].offsets = offsets;
+        return;
+      }
 
-      
-      // Copy data to internal buffers from external buffers
-      // iotype <- srctype
+  // The variable, and its leaf counter, are no longer stored by store
+  field->skip = true;
+  _replan = true;
+
+  Column column;
+  column.field    = field;
+  column.values   = values;
+  column.offsets  = offsets;
+  column.capacity = maxsize;
+  column.srctype  = srctype;
+  if ( field->isvector )
+    {
+      column.counter = selecteddata[field->countername];
+      column.counter->skip = true;
+    }
+  _columns.push_back(column);
+}
 
-      switch(field->iotype)
+int
+otreestream::writecolumns(int count)
+{
+  _statuscode = kSUCCESS;
+  if ( _columns.size() == 0 ) return 0;
+
+  // Store values of variables not bound to columns once
+
+  store();
+
+  for(int entry=0; entry < count; entry++)
+    {
+      for(size_t c=0; c < _columns.size(); c++)
         {
-        case 'D':
-          fromexternal<double>(field);
-          break;
-          
-        case 'F':
-          fromexternal<float> (field);
-          break;
-          
-        case 'L':
-          fromexternal<long>  (field);
-          break;
-          
-        case 'I':
-          fromexternal<int>   (field);
-          break;
+          Column& column = _columns[c];
 
-        case 'S':
-          fromexternal<short> (field);
-          break;
+          int first = entry * column.capacity;
+          int size  = column.capacity;
+          if ( column.offsets )
+            {
+              first = column.offsets[entry];
+              size  = column.offsets[entry+1] - first;
+              if ( size > column.capacity )
+                {
+                  warning("writecolumns - too many values for " 
+                          + column.field->fullname + "; truncated");
+                  size = column.capacity;
+                }
+            }
+          fromcolumn(column, first, size);
+          column.field->size = size;
 
-        case 'B':
-          fromexternal<char> (field);
-          break;
+          if ( column.counter )
+            {
+              // Update leaf counter
+              column.counter->size = size;
+              setcounter(column.counter, size);
+            }
+        }
+      save();
+    }
+  return count;
+}
 
-        case 'O':
-          fromexternal<bool> (field);
-          break;
+void
+otreestream::background(int queuesize)
+{
+  _statuscode = kSUCCESS;
+  if ( _writer ) return;
+  if ( _tree == 0 ) return;
+  if ( _source ) 
+    fatal("background - not available for a skim of an input stream");
 
-        case 'C':
-          fromexternal<string> (field);
-          break;
+  ROOT::EnableThreadSafety();
 
-        case 'l':
-          fromexternal<unsigned long>  (field);
-          break;
-          
-        case 'i':
-          fromexternal<unsigned int>   (field);
-          break;
+  _writer = new BackgroundWriter(this, queuesize);
 
-        case 's':
-          fromexternal<unsigned short> (field);
-          break;
-          
-        default:
-          fromexternal<double>(field);
-          break;
-        }
+  // Lay out the buffers of all branches in a slot
+
+  size_t total = 0;
+  SelectedData::iterator it;
+  for(it = selecteddata.begin(); it != selecteddata.end(); it++)
+    {
+      Field* field = it->second;
+      assert(field);
+      if ( field->iotype == 'C' )
+        fatal("background - string variable " + field->fullname + 
+              " not supported");
+
+      // bool variables are stored in int buffers (see createbranch)
+      char iotype = field->iotype == 'O' ? 'I' : field->iotype;
+      size_t size = field->maxsize * typesize(iotype);
+      total = (total + 7) / 8 * 8;
+
+      _writer->sources.push_back(field->branch->GetAddress());
+      _writer->offsets.push_back(total);
+      _writer->sizes.push_back(size);
+      total += size;
     }
-  DBUG("END store");
-  DBUG("");
+  _writer->buffer.resize(max(total, (size_t)1));
+
+  // Give the writer its own branch buffers
+
+  size_t c = 0;
+  for(it = selecteddata.begin(); it != selecteddata.end(); it++, c++)
+    it->second->branch->SetAddress(&_writer->buffer[_writer->offsets[c]]);
+
+  _writer->worker = thread(&BackgroundWriter::run, _writer);
+
+  DBUG("otreestream::background - writer started", 1);
 }
 
 void
-otreestream::save()
+otreestream::compression(string algorithm, int level)
 {
-  // ..and store away.
+  _statuscode = kSUCCESS;
+  if ( _file == 0 ) return;
 
-  _file->cd();
-  _tree->Fill();
-  _entries++;
+  int settings = compressionsettings(algorithm, level, 
+                                     _file->GetCompressionSettings());
+  _file->SetCompressionSettings(settings);
 
-  //   // Save header every _autosavecount events
-  //   if ( _entries % _autosavecount == 0 )
-  //     {
-  //       cout << _entries << "\totreestream::commit is saving header" << endl;
-  //       _tree->AutoSave("SaveSelf");
-  //     }
+  // Branches take their settings from the file when created, so
+  // update those already created
+  if ( _tree == 0 ) return;
+  TObjArray* array = _tree->GetListOfBranches();
+  if ( array == 0 ) return;
+  for(int i=0; i < array->GetEntries(); i++)
+    {
+      TBranch* branch = (TBranch*)((*array)[i]);
+      if ( branch ) branch->SetCompressionSettings(settings);
+    }
 }
 
 void
-otreestream::commit()
+otreestream::compression(string namen, string algorithm, int level)
 {
-  store();
-  save();
+  _statuscode = kSUCCESS;
+  if ( selecteddata.find(namen) == selecteddata.end() )
+    {
+      warning("otreestream - variable " + namen + " not found");
+      _statuscode = kBADBRANCH;
+      return;
+    }
+  TBranch* branch = selecteddata[namen]->branch;
+  branch->SetCompressionSettings(compressionsettings(algorithm, level, 
+                                   branch->GetCompressionSettings()));
+}
+
+void
+otreestream::basketsize(string namen, int bytes)
+{
+  _statuscode = kSUCCESS;
+  if ( selecteddata.find(namen) == selecteddata.end() )
+    {
+      warning("otreestream - variable " + namen + " not found");
+      _statuscode = kBADBRANCH;
+      return;
+    }
+  selecteddata[namen]->branch->SetBasketSize(bytes);
+}
+
+// ------------------------------------------------------------------------
+// When the tree is first flushed, ROOT optimizes the basket sizes using 
+// the sizes of the entries filled so far.
+// ------------------------------------------------------------------------
+void
+otreestream::optimize(int entries)
+{
+  _statuscode = kSUCCESS;
+  if ( _tree == 0 ) return;
+  if ( entries > 0 ) _tree->SetAutoFlush(entries);
 }
 
 void
@@ -2601,6 +5014,19 @@ otreestream::file() { return _file; }
 TTree*
 otreestream::tree() { return _tree; }
 
+void
+otreestream::trace(bool on)
+{
+  _statuscode = kSUCCESS;
+  _trace = on;
+}
+
+string
+otreestream::tracereport()
+{
+  return ::tracereport(selecteddata);
+}
+
 string 
 otreestream::str() const
 {
@@ -2634,6 +5060,8 @@ otreestream::_add(string namen, void* address, int maxsize,
   _statuscode = kSUCCESS;
   if ( maxsize < 1 )
     fatal("add - external buffer for " + namen + " is of zero length!");
+  if ( _writer )
+    fatal("add - cannot add " + namen + " while writing in the background");
   
   int k = namen.find("/");
   if ( k > -1 ) namen = namen.substr(0, k);
@@ -2734,6 +5162,8 @@ otreestream::_add(string namen, void* address, int maxsize,
     // Update source address, because it may have changed.
     selecteddata[namen]->address = address;
 
+  _replan = true;
+
   DBUG("_add: END");
 }
 
@@ -2743,3 +5173,159 @@ std::ostream& operator<<(std::ostream& os, const otreestream& tuple)
   return os;
 }
 
+
+// ------------------------------------------------------------------------
+// P A R A L L E L
+// ------------------------------------------------------------------------
+ptreestream::ptreestream(vector<string>& filenames_, string treename,
+                         int nworkers, bool byfile, int bufsize)
+  : _filenames(filenames_),
+    _treename(treename),
+    _nworkers(nworkers),
+    _byfile(byfile),
+    _bufsize(bufsize),
+    _entries(0)
+{
+  if ( _filenames.size() == 0 ) fatal("ptreestream - no files given");
+
+  if ( _nworkers < 1 ) _nworkers = (int)thread::hardware_concurrency();
+  if ( _nworkers < 1 ) _nworkers = 1;
+
+  if ( _byfile )
+    // No point in having more workers than files
+    _nworkers = min(_nworkers, (int)_filenames.size());
+  else
+    {
+      // We need the total number of entries to partition the chain
+      itreestream stream(_filenames, _treename, _bufsize);
+      _entries = stream.entries();
+    }
+
+  if ( DEBUGLEVEL > 0 )
+    cout << "ptreestream - workers(" << _nworkers << ")" << endl;
+}
+
+ptreestream::~ptreestream() {}
+
+int
+ptreestream::size() { return _nworkers; }
+
+vector<string>
+ptreestream::filenames(int worker)
+{
+  if ( ! _byfile ) return _filenames;
+
+  // Deal files out to the workers in turn
+  vector<string> fname;
+  for(size_t i=worker; i < _filenames.size(); i += _nworkers)
+    fname.push_back(_filenames[i]);
+  return fname;
+}
+
+string
+ptreestream::filename(string name, int worker)
+{
+  char postfix[80];
+  sprintf(postfix, "_w%d", worker);
+  int k = name.rfind(".root");
+  if ( k < 0 ) return name + string(postfix);
+  return name.substr(0, k) + string(postfix) + name.substr(k);
+}
+
+void
+ptreestream::run(Begin begin, Process process, Merge merge)
+{
+  Batch batch;
+  _run(begin, process, batch, 0, merge);
+}
+
+void
+ptreestream::runbatches(Begin begin, Batch batch, int batchsize, 
+                        Merge merge)
+{
+  if ( batchsize < 1 ) fatal("ptreestream - batch size must be positive");
+  Process process;
+  _run(begin, process, batch, batchsize, merge);
+}
+
+void
+ptreestream::_run(Begin& begin, Process& process, Batch& batch, 
+                  int batchsize, Merge& merge)
+{
+  ROOT::EnableThreadSafety();
+
+  vector<itreestream*> streams(_nworkers, (itreestream*)0);
+  vector<thread> workers;
+  for(int worker=0; worker < _nworkers; worker++)
+    workers.push_back(thread(&ptreestream::_work, this, worker,
+                             ref(begin), ref(process), ref(batch), 
+                             batchsize, &streams[worker]));
+  for(size_t c=0; c < workers.size(); c++) workers[c].join();
+
+  // Merge results one worker at a time
+
+  if ( merge )
+    for(int worker=0; worker < _nworkers; worker++) merge(worker);
+
+  for(size_t c=0; c < streams.size(); c++) delete streams[c];
+}
+
+void
+ptreestream::_work(int worker, Begin& begin, Process& process, Batch& batch,
+                   int batchsize, itreestream** stream_)
+{
+  vector<string> fname = filenames(worker);
+  itreestream* stream = new itreestream(fname, _treename, _bufsize);
+  *stream_ = stream;
+  if ( ! stream->good() ) fatal("ptreestream - unable to read files");
+  
+  // Get range of entries to be read by this worker
+
+  int first = 0;
+  int last  = stream->entries();
+  if ( ! _byfile )
+    {
+      int nentries = _entries / _nworkers;
+      int extra    = _entries % _nworkers;
+      first = worker * nentries + min(worker, extra);
+      last  = first + nentries + (worker < extra ? 1 : 0);
+    }
+
+  if ( DEBUGLEVEL > 0 )
+    cout << "ptreestream - worker(" << worker << ") "
+         << "entries(" << first << ", " << last << ")" << endl;
+
+  if ( begin ) begin(*stream, worker);
+
+  if ( batchsize > 0 )
+    {
+      for(int start=first; start < last; start += batchsize)
+        batch(*stream, start, min(batchsize, last - start), worker);
+    }
+  else
+    {
+      for(int entry=first; entry < last; entry++)
+        {
+          if ( stream->read(entry) < 0 ) break;
+          process(*stream, entry, worker);
+        }
+    }
+}
+
+bool
+ptreestream::mergefiles(vector<string>& filenames_, string output)
+{
+  TFileMerger merger(false);
+  if ( ! merger.OutputFile(output.c_str(), "RECREATE") )
+    {
+      warning("ptreestream - unable to create file " + output);
+      return false;
+    }
+  for(size_t i=0; i < filenames_.size(); i++)
+    if ( ! merger.AddFile(filenames_[i].c_str(), false) )
+      {
+        warning("ptreestream - unable to add file " + filenames_[i]);
+        return false;
+      }
+  return merger.Merge();
+}
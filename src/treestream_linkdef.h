@@ -4,6 +4,7 @@
 #pragma link off all functions;
 #pragma link C++ class itreestream+;
 #pragma link C++ class otreestream+;
+#pragma link C++ class ptreestream;
 #pragma link C++ class vector<vector<double> >+;
 #pragma link C++ class vector<vector<float> >+;
 #pragma link C++ class vector<vector<long> >+;
@@ -12,6 +13,15 @@
 #pragma link C++ class vector<vector<unsigned long> >+;
 #pragma link C++ class vector<vector<unsigned int> >+;
 
+#pragma link C++ class jagged<double>+;
+#pragma link C++ class jagged<float>+;
+#pragma link C++ class jagged<long>+;
+#pragma link C++ class jagged<int>+;
+#pragma link C++ class jagged<short>+;
+#pragma link C++ class jagged<bool>+;
+#pragma link C++ class jagged<unsigned int>+;
+#pragma link C++ class jagged<unsigned short>+;
+
 #pragma link C++ class vector<double*>+;
 #pragma link C++ class vector<float*>+;
 #pragma link C++ class vector<long*>+;
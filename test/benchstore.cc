@@ -0,0 +1,93 @@
+//----------------------------------------------------------------------------
+// File: benchstore.cc
+// Description:
+//
+// Measure the rate, in entries/second, at which otreestream stores and
+// commits entries for trees with 100, 500 and 1500 branches. One in five
+// variables is a variable length array with its own leaf counter.
+//
+// Run this program before and after a change to otreestream::store to
+// compare rates.
+//
+// Created: 18-Oct-2026
+//----------------------------------------------------------------------------
+#include <chrono>
+#include <iomanip>
+#include <vector>
+#include "treestream.h"
+using namespace std;
+//----------------------------------------------------------------------------
+const string FILENAME("benchstore.root");
+const string TREENAME("Events");
+const int    ENTRIES = 10000;
+//----------------------------------------------------------------------------
+double seconds(chrono::steady_clock::time_point start)
+{
+  chrono::duration<double> t = chrono::steady_clock::now() - start;
+  return t.count();
+}
+//----------------------------------------------------------------------------
+void bench(int nbranches, int entries=ENTRIES)
+{
+  otreestream stream(FILENAME, TREENAME, "benchstore");
+
+  int nvectors = nbranches / 5;
+  int nscalars = nbranches - 2 * nvectors; // each vector has a counter
+
+  vector<float> scalars(nscalars, 0);
+  vector<vector<float> > vectors(nvectors, vector<float>(10, 0));
+
+  char name[80];
+  for(int i=0; i < nscalars; i++)
+    {
+      sprintf(name, "x%4.4d", i);
+      stream.add(name, scalars[i]);
+    }
+  for(int i=0; i < nvectors; i++)
+    {
+      sprintf(name, "v%4.4d", i);
+      stream.add(name, vectors[i]);
+    }
+
+  // time store only
+
+  chrono::steady_clock::time_point start = chrono::steady_clock::now();
+  for(int entry=0; entry < entries; entry++)
+    {
+      for(int i=0; i < nscalars; i++) scalars[i] = entry + i;
+      for(int i=0; i < nvectors; i++) vectors[i].resize(entry % 10);
+      stream.store();
+    }
+  double tstore = seconds(start);
+
+  // time store and save
+
+  start = chrono::steady_clock::now();
+  for(int entry=0; entry < entries; entry++)
+    {
+      for(int i=0; i < nscalars; i++) scalars[i] = entry + i;
+      for(int i=0; i < nvectors; i++) vectors[i].resize(entry % 10);
+      stream.commit();
+    }
+  double tcommit = seconds(start);
+
+  stream.close();
+
+  cout << setw(10) << nbranches
+       << setw(16) << setprecision(0) << fixed << entries / tstore
+       << setw(16) << setprecision(0) << fixed << entries / tcommit
+       << endl;
+}
+//----------------------------------------------------------------------------
+int main()
+{
+  cout << setw(10) << "branches"
+       << setw(16) << "store/sec"
+       << setw(16) << "commit/sec"
+       << endl;
+
+  bench(100);
+  bench(500);
+  bench(1500);
+  return 0;
+}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#------------------------------------------------------------------------------
+# File: testtable.py
+# Description: test tnm.Table, which does not need ROOT. ROOT is replaced
+#              by a mock so that tnm can be imported without it.
+#
+#   python test/testtable.py
+#
+# Created: 18-Oct-2026
+#------------------------------------------------------------------------------
+import os, sys, shutil, tempfile, unittest
+from unittest import mock
+sys.modules.setdefault('ROOT', mock.MagicMock())
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'tnm'))
+import tnm
+#------------------------------------------------------------------------------
+class TestTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, records, name='table.txt'):
+        filename = os.path.join(self.tmpdir, name)
+        out = open(filename, 'w')
+        for record in records:
+            out.write('%s\n' % record)
+        out.close()
+        return filename
+
+    def table(self, nrows=100):
+        records = ['x y name', '']
+        for i in range(nrows):
+            records.append('%d %g n%d' % (i, 0.5*i, i))
+            if i % 7 == 0: records.append('')
+        return self.write(records)
+
+    def test_read(self):
+        for chunksize in [1, 3, 100000]:
+            t = tnm.Table(self.table(), chunksize=chunksize)
+            self.assertEqual(t.nrows, 100)
+            self.assertEqual(t.variables(), ['x', 'y', 'name'])
+            self.assertEqual(t.column('x').dtype, 'float64')
+            self.assertEqual(t(10, 'y'), 5.0)
+            self.assertEqual(t(99)('name'), 'n99')
+            self.assertEqual(t(100), None)
+
+    def test_iterate(self):
+        t = tnm.Table(self.table())
+        rows = [row('x') for row in t]
+        self.assertEqual(rows, [float(x) for x in range(100)])
+        self.assertEqual(dict(t(3))['name'], 'n3')
+
+    def test_nrows(self):
+        t = tnm.Table(self.table(), nrows=10, chunksize=4)
+        self.assertEqual(t.nrows, 10)
+        self.assertEqual(t(9, 'x'), 9.0)
+
+    def test_mixed_column(self):
+        filename = self.write(['x y', '1 2', '3 4', 'a 5', '6 7'])
+        t = tnm.Table(filename, chunksize=1)
+        self.assertEqual(list(t.column('x')), [1.0, 3.0, 'a', 6.0])
+        self.assertEqual(t.column('y').dtype, 'float64')
+
+    def test_mixed_first_chunk(self):
+        filename = self.write(['x', '1', '2', 'NA', '4'])
+        for chunksize in [1, 2, 100000]:
+            t = tnm.Table(filename, chunksize=chunksize)
+            self.assertEqual(list(t.column('x')), [1.0, 2.0, 'NA', 4.0])
+        filename = self.write(['x', 'NA', '1', '2'])
+        for chunksize in [1, 100000]:
+            t = tnm.Table(filename, chunksize=chunksize)
+            self.assertEqual(list(t.column('x')), ['NA', 1.0, 2.0])
+
+    def test_string_column(self):
+        filename = self.write(['x', 'a', 'b'])
+        for chunksize in [1, 100000]:
+            t = tnm.Table(filename, chunksize=chunksize)
+            self.assertEqual(t.column('x').dtype.kind, 'U')
+            self.assertEqual(list(t.column('x')), ['a', 'b'])
+
+    def test_mmap(self):
+        filename = self.table()
+        t = tnm.Table(filename, mmap=True, chunksize=8)
+        self.assertTrue(os.path.exists('%s.cache/columns.txt' % filename))
+        t = tnm.Table(filename, mmap=True)
+        self.assertEqual(t.nrows, 100)
+        self.assertEqual(t(42, 'y'), 21.0)
+        self.assertEqual(t(42, 'name'), 'n42')
+
+    def test_mmap_mixed_column(self):
+        filename = self.write(['x', '1', 'b'])
+        tnm.Table(filename, mmap=True, chunksize=1)
+        t = tnm.Table(filename, mmap=True)
+        self.assertEqual(list(t.column('x')), [1.0, 'b'])
+
+    def test_empty(self):
+        filename = self.write(['x y'])
+        for mmap in [False, True]:
+            t = tnm.Table(filename, mmap=mmap)
+            self.assertEqual(t.nrows, 0)
+            self.assertEqual([row for row in t], [])
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,9 @@
 // be called from C++ or Python (via PyROOT). This example shows how to
 // use them.
 //
+// The round-trip tests write an ntuple with known values, read it back 
+// and check the values. main returns the number of failed checks.
+//
 // Created: 20-Sep-2018 Harrison B. Prosper
 //----------------------------------------------------------------------------
 #include <ctime>
@@ -24,6 +27,21 @@
 #include "treestream.h"
 using namespace std;
 //----------------------------------------------------------------------------
+const int ENTRIES = 1000;
+int failures = 0;
+
+void check(bool ok, string what)
+{
+  if ( ok ) return;
+  cout << "** FAILED ** " << what << endl;
+  failures++;
+}
+
+// known values of entry i
+int    njetof(int i)      { return i % 5; }
+double HTof(int i)        { return 0.5 * i; }
+float  jetetof(int i, int j) { return i + 0.25 * j; }
+//----------------------------------------------------------------------------
 void write_ntuple(string filename="test.root", string treename="Events")
 {
   time_t t = time(0);
@@ -108,6 +126,212 @@ void read_ntuple(string filename="test.root", string treename="Events")
   stream.close();
 }
 //----------------------------------------------------------------------------
+// Write an ntuple with known values, either into one file or, if 
+// maxentries > 0, into a new file every maxentries entries.
+vector<string> write_known(string filename, int maxentries=0)
+{
+  otreestream stream(filename, "Events", "round trip");
+  if ( maxentries > 0 ) stream.rollover(maxentries);
+
+  double HT = 0;
+  int njet  = 0;
+  vector<float> jetet(20);
+
+  stream.add("HT", HT);  
+  stream.add("njet", njet);
+  stream.add("jetet[njet]", jetet);
+
+  for(int entry=0; entry < ENTRIES; entry++)
+    {
+      HT   = HTof(entry);
+      njet = njetof(entry);
+      jetet.clear();
+      for(int j=0; j < njet; j++) jetet.push_back(jetetof(entry, j));
+      stream.commit();
+    }
+  vector<string> filenames = stream.filenames();
+  stream.close();
+  return filenames;
+}
+
+// Check the values of the given entry.
+bool known(int entry, double HT, int njet, const float* jetet)
+{
+  if ( HT != HTof(entry) || njet != njetof(entry) ) return false;
+  for(int j=0; j < njet; j++)
+    if ( jetet[j] != jetetof(entry, j) ) return false;
+  return true;
+}
+//----------------------------------------------------------------------------
+void test_columns(string filename)
+{
+  itreestream stream(filename, "Events");
+
+  const int start = 3;
+  const int count = 100;
+  vector<double> HT(count);
+  vector<int>    njet(count);
+  vector<float>  jetet(5 * count);
+  vector<int>    offsets(count + 1);
+
+  stream.column("HT",    &HT[0],    count);
+  stream.column("njet",  &njet[0],  count);
+  stream.column("jetet", &jetet[0], jetet.size(), &offsets[0]);
+
+  int n = stream.readcolumns(start, count);
+  check(n == count, "readcolumns count");
+  check(offsets[0] == 0, "readcolumns first offset");
+  bool ok = true;
+  for(int i=0; i < n; i++)
+    ok = ok 
+      && offsets[i+1] - offsets[i] == njet[i]
+      && known(start + i, HT[i], njet[i], &jetet[offsets[i]]);
+  check(ok, "readcolumns values");
+
+  // only 10 entries are left
+  n = stream.readcolumns(ENTRIES - 10, count);
+  check(n == 10, "readcolumns at end of stream");
+  stream.close();
+}
+//----------------------------------------------------------------------------
+void test_entries(string filename)
+{
+  itreestream stream(filename, "Events");
+  double HT;
+  stream.select("HT", HT);
+
+  stream.addrange(100, 200);
+  vector<int> entries(1, 5);
+  stream.addentries(entries);
+  check(stream.selectedentries() == 101, "selectedentries");
+
+  int count = 0;
+  int entry = stream.next();
+  check(entry == 5, "first entry of list");
+  bool ok = true;
+  for(; entry >= 0; entry = stream.next())
+    {
+      ok = ok && HT == HTof(entry) && (entry == 5 || 
+                                       (entry >= 100 && entry < 200));
+      count++;
+    }
+  check(ok, "values of listed entries");
+  check(count == 101, "number of listed entries");
+
+  // the list read replaces the current list
+  string listname = filename + ".entries";
+  stream.writeentries(listname);
+  stream.clearentries();
+  stream.addrange(0, 10);
+  check(stream.readentries(listname), "readentries");
+  check(stream.selectedentries() == 101, "entries read");
+  stream.close();
+}
+//----------------------------------------------------------------------------
+void test_rollover(string filename)
+{
+  vector<string> filenames = write_known(filename, 300);
+  check(filenames.size() == 4, "number of rollover files");
+  if ( filenames.size() > 1 )
+    check(filenames[1] == "roundtrip_rollover_0001.root", 
+          "name of second rollover file");
+
+  itreestream stream(filenames, "Events");
+  check(stream.entries() == ENTRIES, "entries in rollover files");
+
+  double HT;
+  int njet;
+  vector<float> jetet(20);
+  stream.select("HT", HT);
+  stream.select("njet", njet);
+  stream.select("jetet", jetet);
+  bool ok = true;
+  for(int entry=0; entry < stream.entries(); entry++)
+    {
+      stream.read(entry);
+      ok = ok && known(entry, HT, njet, &jetet[0]);
+    }
+  check(ok, "values in rollover files");
+  stream.close();
+}
+//----------------------------------------------------------------------------
+void test_jagged(string filename)
+{
+  itreestream stream(filename, "Events");
+  jagged<float> jetet;
+  stream.select("jetet", jetet);
+  const int count = 50;
+  for(int entry=0; entry < count; entry++) stream.read(entry);
+  stream.close();
+
+  check(jetet.size() == count, "rows of jagged array");
+  bool ok = true;
+  for(int i=0; i < jetet.size(); i++)
+    ok = ok && jetet.count(i) == njetof(i) 
+      && known(i, HTof(i), jetet.count(i), &jetet.values[jetet.offsets[i]]);
+  check(ok, "values of jagged array");
+
+  // write the last row of the array as each entry
+  string outname("roundtrip_jagged.root");
+  otreestream out(outname, "Events", "jagged");
+  int njet = 0;
+  jagged<float> rows;
+  out.add("njet", njet);
+  out.add("jetet[njet]", rows, 20);
+  for(int i=0; i < jetet.size(); i++)
+    {
+      njet = jetet.count(i);
+      rows.push_back(vector<float>(&jetet.values[jetet.offsets[i]],
+                                   &jetet.values[jetet.offsets[i+1]]));
+      out.commit();
+    }
+  out.close();
+
+  itreestream in(outname, "Events");
+  vector<float> values(20);
+  in.select("njet", njet);
+  in.select("jetet", values);
+  ok = in.entries() == count;
+  for(int entry=0; entry < in.entries(); entry++)
+    {
+      in.read(entry);
+      ok = ok && known(entry, HTof(entry), njet, &values[0]) 
+        && njet == njetof(entry);
+    }
+  check(ok, "values written from jagged array");
+  in.close();
+}
+//----------------------------------------------------------------------------
+void test_skim(string filename)
+{
+  string skimname("roundtrip_skim.root");
+  itreestream stream(filename, "Events");
+  // the leaf counter njet of jetet is kept without being named
+  otreestream skim(skimname, stream, "HT jetet");
+  stream.addrange(200, 300);
+  while ( stream.next() >= 0 ) skim.commit();
+  skim.close();
+  stream.close();
+
+  itreestream in(skimname, "Events");
+  check(in.entries() == 100, "entries in skim");
+
+  double HT;
+  int njet;
+  vector<float> jetet(20);
+  in.select("HT", HT);
+  in.select("njet", njet);
+  in.select("jetet", jetet);
+  bool ok = true;
+  for(int entry=0; entry < in.entries(); entry++)
+    {
+      in.read(entry);
+      ok = ok && known(200 + entry, HT, njet, &jetet[0]);
+    }
+  check(ok, "values in skim");
+  in.close();
+}
+//----------------------------------------------------------------------------
 int main()
 {
   cout << endl << "treestream: WRITE test" << endl;
@@ -115,5 +339,15 @@ int main()
   
   cout << endl << "treestream: READ  test" << endl;  
   read_ntuple();
-  return 0;
+
+  cout << endl << "treestream: ROUND TRIP tests" << endl;
+  string filename("roundtrip.root");
+  write_known(filename);
+  test_columns(filename);
+  test_entries(filename);
+  test_rollover("roundtrip_rollover.root");
+  test_jagged(filename);
+  test_skim(filename);
+  cout << failures << " failed checks" << endl;
+  return failures;
 }
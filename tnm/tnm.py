@@ -4,6 +4,7 @@
 #-----------------------------------------------------------------------------
 import os, sys, re
 from glob import glob
+from fnmatch import fnmatch
 from array import array
 from math import sqrt
 import ROOT
@@ -551,13 +552,14 @@ def mklegend(xx, yy, xw, yw):
     lg.SetShadowColor(kWhite)
     return lg
 #------------------------------------------------------------------------------
+# A row of a Table. The row is a view into the columns of the table; no
+# values are copied.
 class Row:
     def __init__(self, rownumber, varmap, data):
         self.row = rownumber
         self.varmap = varmap
-        self.data = data
-        self.items = map(lambda x: (x[1],x[0]), self.varmap.items())
-        self.items.sort()
+        self.data = data # columns
+        self.items = sorted([(x[1], x[0]) for x in self.varmap.items()])
 
         # Initialize row counter
         self.col = 0
@@ -567,20 +569,20 @@ class Row:
         pass
 
     def __call__(self, variable):
-        if not self.varmap.has_key(variable): return None
+        if not variable in self.varmap: return None
         index = self.varmap[variable]
-        return self.data[index]
+        return self.data[index][self.row]
 
     def __str__(self):
         strrep = "Row: %d\n" % self.row
         for index, name in self.items:
-            value = self.data[index]
-            if type(value) != type(""):
+            value = self.data[index][self.row]
+            if not isinstance(value, str):
                 strvalue = "%12.3f" % value
             else:
                 strvalue = "%12s" % value
             strrep += "%4d\t%-32s\t%s\n" % (index, name, strvalue)
-        return strip(strrep)
+        return strrep.strip()
 
     # Implement Python iterator protocol
 
@@ -593,52 +595,179 @@ class Row:
             raise StopIteration
         else:
             index, name = self.items[self.col]
-            value = self.data[index]
+            value = self.data[index][self.row]
             self.col += 1
             return (name, value)
+    __next__ = next
 #------------------------------------------------------------------------------
 def tonumber(x):
     try:
-        y = atof(x)
+        y = float(x)
     except:
         y = x
     return y
 
+# Return an upper bound on the number of records in a text file
+def countlines(filename):
+    count = 1
+    tfile = open(filename, 'rb')
+    while True:
+        block = tfile.read(1 << 20)
+        if not block: break
+        count += block.count(b'\n')
+    tfile.close()
+    return count
+
+# A table of numbers (and strings) read from a text file whose first record
+# is a header of column names. The file is parsed in chunks of chunksize
+# records into a NumPy array per column: float64 if the column is numeric,
+# otherwise strings. If mmap is True, the columns are kept in files, one
+# per column, in the directory <filename>.cache and memory-mapped; the
+# next Table of the same file maps these files instead of parsing it.
 class Table:
 
-    def __init__(self, filename, nrows=-1):
+    def __init__(self, filename, nrows=-1, chunksize=100000, mmap=False):
+        import numpy as np
         try:
             tfile = open(filename, 'r')
         except:
             sys.exit("*** can't read file %s" % filename)
 
         # Read header
-        records = tfile.readlines()
-        header  = split(records[0])
+        header  = tfile.readline().split()
         self.header = header
 
-        row = 0
-        self.data = []
-        index = 1
-        for record in records[1:]:
-            # Convert to numbers
-            record = map(tonumber, split(record))
-            self.data.append(record)
-            row += 1
-            if nrows > 0:
-                if row >= nrows:
-                    break
-        tfile.close()
-
-        # Initialize row counter
-        self.row = 0
-        self.maxrow = len(self.data)-1
-
         # Create a name to index map
         self.varmap = {} # empty map
         for index, name in enumerate(header):
             self.varmap[name] = index
 
+        cachedir = '%s.cache' % filename
+        usecache = mmap and nrows < 1
+        if usecache and self.__readcache(cachedir, filename):
+            tfile.close()
+        else:
+            self.__parse(tfile, nrows, chunksize, usecache and cachedir)
+            tfile.close()
+
+        # Initialize row counter
+        self.row = 0
+        self.maxrow = self.nrows-1
+        self.current = Row(0, self.varmap, self.data)
+
+    def __parse(self, tfile, nrows, chunksize, cachedir):
+        import numpy as np
+        from itertools import islice
+
+        size = countlines(tfile.name)
+        if nrows > 0: size = min(size, nrows)
+
+        if cachedir and not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+
+        ncols = len(self.header)
+        self.data = None
+        mixed = set() # numeric columns found to contain strings
+        row = 0
+        while nrows < 1 or row < nrows:
+            lines = list(islice(tfile, chunksize))
+            if len(lines) == 0: break
+            records = [x.split() for x in lines if x.strip() != '']
+            if nrows > 0: records = records[:nrows-row]
+            if len(records) == 0: continue
+            for record in records:
+                if len(record) != ncols:
+                    sys.exit("*** Table: record with %d fields, expected %d" \
+                                 % (len(record), ncols))
+            columns = list(zip(*records))
+
+            # type of each column is decided by the first chunk
+            if self.data is None:
+                self.data = []
+                for index, column in enumerate(columns):
+                    try:
+                        np.array(column, dtype='float64')
+                        dtype = 'float64'
+                    except ValueError:
+                        dtype = object
+                    if cachedir and dtype == 'float64':
+                        name = os.path.join(cachedir, '%d.npy' % index)
+                        a = np.lib.format.open_memmap(name, mode='w+',
+                                                      dtype=dtype, 
+                                                      shape=(size,))
+                    else:
+                        a = np.empty(size, dtype=dtype)
+                    self.data.append(a)
+
+            # a column is numeric if all its values are numbers, a string
+            # column if none are, and otherwise mixed: numbers are kept as
+            # numbers and the rest as strings, whatever the chunksize.
+            n = len(records)
+            for index, column in enumerate(columns):
+                if self.data[index].dtype == object:
+                    values = [tonumber(x) for x in column]
+                    if not index in mixed:
+                        for x in values:
+                            if not isinstance(x, str):
+                                mixed.add(index)
+                                break
+                    self.data[index][row:row+n] = values
+                    continue
+                try:
+                    self.data[index][row:row+n] = column
+                except ValueError:
+                    # not a numeric column after all: keep numbers as
+                    # numbers and the rest as strings
+                    a = np.empty(size, dtype=object)
+                    a[:row] = self.data[index][:row]
+                    a[row:row+n] = [tonumber(x) for x in column]
+                    self.data[index] = a
+                    mixed.add(index)
+            row += n
+
+        if self.data is None:
+            self.data = [np.empty(0) for x in self.header]
+
+        # string columns are stored as NumPy strings
+        for index, column in enumerate(self.data):
+            if column.dtype == object and not index in mixed:
+                self.data[index] = column[:row].astype(str)
+            else:
+                self.data[index] = column[:row]
+        self.nrows = row
+
+        if cachedir:
+            for index, column in enumerate(self.data):
+                if isinstance(column, np.memmap):
+                    column.flush()
+                else:
+                    np.save(os.path.join(cachedir, '%d.npy' % index), column,
+                            allow_pickle=True)
+            out = open(os.path.join(cachedir, 'columns.txt'), 'w')
+            out.write('%d\n%s\n' % (row, ' '.join(self.header)))
+            out.close()
+
+    # map the columns cached for given file, if the cache is up to date
+    def __readcache(self, cachedir, filename):
+        import numpy as np
+        name = os.path.join(cachedir, 'columns.txt')
+        if not os.path.exists(name): return False
+        if os.path.getmtime(name) < os.path.getmtime(filename): return False
+        records = open(name).readlines()
+        if len(records) < 2 or records[1].split() != self.header: 
+            return False
+        self.nrows = int(records[0])
+        self.data = []
+        for index in range(len(self.header)):
+            name = os.path.join(cachedir, '%d.npy' % index)
+            try:
+                a = np.load(name, mmap_mode='r')
+            except ValueError:
+                # columns of numbers and strings cannot be mapped
+                a = np.load(name, allow_pickle=True)
+            self.data.append(a[:self.nrows])
+        return True
+
     def __del__(self):
         pass
 
@@ -646,13 +775,20 @@ class Table:
         if row < 0: return None
         if row > self.maxrow: return None
         if variable == None:
-            return Row(row, self.varmap, self.data[row])
+            return Row(row, self.varmap, self.data)
         else:
-            if not self.varmap.has_key(variable): return None
+            if not variable in self.varmap: return None
             index = self.varmap[variable]
-            return self.data[row][index]
+            return self.data[index][row]
+
+    # Return NumPy array of values of given variable
+    def column(self, variable):
+        if not variable in self.varmap: return None
+        return self.data[self.varmap[variable]]
 
     # Implement Python iterator protocol
+    # Note: the same Row object, a view of the current row, is returned
+    # for every row; use table(row) to get a Row that can be kept.
 
     def __iter__(self):
         return self
@@ -662,12 +798,112 @@ class Table:
             self.row = 0
             raise StopIteration
         else:
-            data = Row(self.row, self.varmap, self.data[self.row])
+            self.current.row = self.row
+            self.current.col = 0
             self.row += 1
-            return data
+            return self.current
+    __next__ = next
+
     def variables(self):
         return self.header
 #------------------------------------------------------------------------------
+# map ROOT leaf types to NumPy types
+NUMPYTYPES = {'Double_t':   'float64',
+              'Double32_t': 'float64',
+              'Float_t':    'float32',
+              'Float16_t':  'float32',
+              'Long64_t':   'int64',
+              'Long_t':     'int64',
+              'ULong64_t':  'uint64',
+              'ULong_t':    'uint64',
+              'Int_t':      'int32',
+              'UInt_t':     'uint32',
+              'Short_t':    'int16',
+              'UShort_t':   'uint16',
+              'Char_t':     'int16',
+              'UChar_t':    'uint8',
+              'Bool_t':     'bool'}
+
+# Cache of structs used as buffers by Ntuple, keyed by a hash of the 
+# variables (type, name, maxcount). Within a process, each struct is
+# compiled once. If the directory $TNM_CACHE (default: ~/.cache/tnm) 
+# is writable, the structs are also compiled, using ACLiC, into shared
+# libraries that are kept there and loaded by later processes.
+BUFFERSTRUCTS = {}
+
+def bufferstructs(variables):
+    import hashlib
+    key = hashlib.sha1(repr(variables).encode()).hexdigest()[:16]
+    if key in BUFFERSTRUCTS:
+        return BUFFERSTRUCTS[key]
+
+    # Root has a limit on how long a
+    # string it can cope with, so split
+    # into multiple strings
+
+    maxlength = 2000
+    buffermap = {}
+    records   = []
+    rec = ""
+    for count, (tname, name, maxcount) in enumerate(variables):
+
+        # keep track of map from variable name to buffer count
+        buffermap[name] = len(records)
+
+        if rec == "":
+            rec = "struct S%s_%d {" % (key, len(records))
+
+        if maxcount == 1:
+            rec += "%s %s;" % (tname, name)
+        else:				
+            rec += "%s %s[%d];" % (tname, name, maxcount)
+
+        if (len(rec) > maxlength) or (count >= len(variables)-1):
+            rec += "};"
+            records.append(rec)
+            rec = ""
+    structnames = ["S%s_%d" % (key, x) for x in range(len(records))]
+
+    # try to load, or build, shared library of structs
+
+    cachedir = os.environ.get('TNM_CACHE',
+                              os.path.join(os.path.expanduser('~'),
+                                           '.cache', 'tnm'))
+    compiled = False
+    try:
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        srcname = os.path.join(cachedir, 'S%s.C' % key)
+        if not os.path.exists(srcname):
+            # write to a temporary file first in case another process
+            # is writing the same file
+            tmpname = '%s.%d' % (srcname, os.getpid())
+            out = open(tmpname, 'w')
+            out.write('#include "Rtypes.h"\n')
+            for rec in records:
+                out.write('%s\n' % rec)
+            out.close()
+            os.rename(tmpname, srcname)
+        # only one process at a time may build, or load, the library
+        import fcntl
+        lock = open(os.path.join(cachedir, 'S%s.lock' % key), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            compiled = \
+                ROOT.gSystem.CompileMacro(srcname, 'k', '', cachedir) == 1
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+    except:
+        compiled = False
+
+    if not compiled:
+        for rec in records:
+            ROOT.gROOT.ProcessLine(rec)
+
+    BUFFERSTRUCTS[key] = (structnames, buffermap)
+    return BUFFERSTRUCTS[key]
+
 class Buffer:
 
     def __init__(self, buffer, buffermap, variable):
@@ -693,13 +929,14 @@ class Ntuple:
     # "self" is Python's equivalent of the "this" pointer in C++
     # self points to the memory allocated for the object
 
-    def __init__(self, filename, treename, nrows=None):
+    # columns: names of variables to be read, or glob patterns, given as
+    # a list or as a space separated string. Other branches are disabled
+    # so that they are not read. By default, all variables are read.
+    def __init__(self, filename, treename, nrows=None, columns=None):
 
         # cache inputs
         self.status = 0
 
-        from random import randint
-        self.postfix  = randint(1, 1000000)
         if type(filename) == type(""):
             self.filename = [filename]
         else:
@@ -764,6 +1001,7 @@ class Ntuple:
  
         # print variables
         self.vars = []
+        self.counters = {}
         #print "variables:"
         for i in xrange(nbranches):
             # get the ith branch (aka variable)
@@ -799,7 +1037,29 @@ class Ntuple:
 
             # store type and variable name
             self.vars.append( (tname, bname, maxcount) )
+            if leafcounter:
+                self.counters[bname] = leafcounter.GetName()
             #print("\t%4d\t%-12s\t%-32s\t%d" % (i, tname, bname, maxcount))
+
+        # keep selected variables, and their leaf counters, only
+        if columns != None:
+            if type(columns) == type(""):
+                columns = columns.split()
+            selected = set()
+            for pattern in columns:
+                names = [x for t, x, m in self.vars if fnmatch(x, pattern)]
+                if len(names) == 0:
+                    sys.exit("** Ntuple *** no variable matches %s" % pattern)
+                selected.update(names)
+            for name in list(selected):
+                if name in self.counters:
+                    selected.add(self.counters[name])
+            self.vars = [x for x in self.vars if x[1] in selected]
+
+            tree.SetBranchStatus("*", 0)
+            for tname, name, maxcount in self.vars:
+                tree.SetBranchStatus(name, 1)
+
         nlen = len(self.vars)
 
         # create a map of variable name to column number
@@ -816,51 +1076,12 @@ class Ntuple:
             self.entries = nentries
         # ------------------------------------
         # set up branches as a struct
-        # Root has a limit on how long a
-        # string it can cope with, so split
-        # into multiple strings
+        # The structs are compiled once per
+        # layout of variables (see 
+        # bufferstructs)
         # ------------------------------------
-
-        bufferCount = 0
-        newBuffer = True
-        rec = ""
-        bufferName = ""
-        maxlength  = 2000
-        self.buffermap  = {}
-        self.buffer = []
-
-        for count, (tname, name, maxcount) in enumerate(self.vars):
-
-            # keep track of map from variable name to buffer count
-            self.buffermap[name] = bufferCount
-
-            if newBuffer:
-                newBuffer = False
-                bufferName = "S%d_%d" % (self.postfix, bufferCount)
-                rec = "struct %s {" % bufferName
-
-            if maxcount == 1:
-                rec += "%s %s;" % (tname, name)
-            else:				
-                rec += "%s %s[%d];" % (tname, name, maxcount)
-
-            if (len(rec) > maxlength) or \
-                   (count >= len(self.vars)-1):
-                rec += "};"
-                newBuffer = True
-
-                # evaluate it
-
-                gROOT.ProcessLine(rec)
-
-                # now import struct
-                exec("from ROOT import %s" % bufferName)
-
-                # add to list of buffers
-                self.buffer.append(eval("%s()" % bufferName))
-
-                # remember to update buffer count
-                bufferCount += 1
+        structnames, self.buffermap = bufferstructs(self.vars)
+        self.buffer = [getattr(ROOT, x)() for x in structnames]
 
         # create a generic event object
         self.event = Buffer(self.buffer, self.buffermap, self.vars)
@@ -919,6 +1140,79 @@ class Ntuple:
     def ls(self):
         print(self.__str__())
 
+    # Read many rows at a time into NumPy arrays
+    #
+    # Example:
+    #   for batch in ntuple.batches(10000, ['nJet', 'Jet_pt']):
+    #       pt = batch['Jet_pt']
+    #       offsets = batch['Jet_pt_offsets']
+    #       ...
+    #
+    # Each batch is a dictionary of NumPy arrays, one per variable, with
+    # the values of up to size rows. A fixed length array is returned as
+    # an array of shape (rows, length). A variable length array is returned
+    # as the values of all rows one after the other, together with an 
+    # array, <name>_offsets, of rows+1 offsets such that the values of row
+    # i are values[offsets[i]:offsets[i+1]].
+    #
+    # Note: the arrays are reused; copy them if they are to be kept beyond
+    # the next batch. Only rows start to stop-1 are read, if given.
+    def batches(self, size=10000, columns=None, start=0, stop=None):
+        import numpy as np
+
+        if columns == None:
+            columns = [name for tname, name, maxcount in self.vars]
+        elif type(columns) == type(""):
+            columns = columns.split()
+
+        vartype = {}
+        for tname, name, maxcount in self.vars:
+            vartype[name] = (tname, maxcount)
+
+        stream = ROOT.itreestream(' '.join(self.filename), self.treename)
+        if not stream.good():
+            sys.exit("** Ntuple *** can't read %s" % self.treename)
+
+        arrays = {}
+        for name in columns:
+            if not name in vartype:
+                sys.exit("** Ntuple *** variable %s not found" % name)
+            tname, maxcount = vartype[name]
+            if not tname in NUMPYTYPES:
+                sys.exit("** Ntuple *** type %s of %s not handled" % \
+                             (tname, name))
+            maxcount = max(maxcount, 1)
+            values = np.zeros(size * maxcount, dtype=NUMPYTYPES[tname])
+            if name in self.counters:
+                offsets = np.zeros(size + 1, dtype='int32')
+                stream.column(name, values, len(values), offsets)
+            else:
+                offsets = None
+                stream.column(name, values, len(values))
+            arrays[name] = (values, offsets, maxcount)
+
+        if stop == None or stop > self.entries:
+            stop = self.entries
+        row = start
+        while row < stop:
+            count = stream.readcolumns(row, min(size, stop - row))
+            if count < 1:
+                sys.exit("** Ntuple *** unable to read row %d" % row)
+
+            batch = {}
+            for name, (values, offsets, maxcount) in arrays.items():
+                if offsets is not None:
+                    batch[name] = values[:offsets[count]]
+                    batch['%s_offsets' % name] = offsets[:count+1]
+                elif maxcount > 1:
+                    batch[name] = values[:count*maxcount].reshape(count, 
+                                                                  maxcount)
+                else:
+                    batch[name] = values[:count]
+            yield batch
+            row += count
+        stream.close()
+
     # Implement Python iterator protocol
 
     def __iter__(self):
@@ -939,6 +1233,157 @@ class Ntuple:
             self.row += 1
             return self.event
 #------------------------------------------------------------------------------
+# Run an event loop over the given files in several processes.
+#
+#   book()                   returns a dictionary of objects to be filled,
+#                            e.g., histograms and counters, and is called
+#                            once in each process.
+#   process(event, objects)  is called for every event, or, if batchsize 
+#                            > 0, process(batch, objects) is called for 
+#                            every batch (see Ntuple.batches).
+#
+# The entries are split evenly among the processes, each of which reads
+# its entries with its own Ntuple. The objects are then merged: ROOT
+# objects (histograms, graphs, etc.) are added using their Merge method,
+# numbers are summed, as are dictionaries of numbers, e.g., counts of
+# events passing each cut. The merged objects are returned.
+#
+# Example:
+#   def book():
+#       return {'hpt': ROOT.TH1F('hpt', '', 100, 0, 500), 'count': 0}
+#
+#   def process(event, objects):
+#       objects['hpt'].Fill(event.Jet_pt[0])
+#       objects['count'] += 1
+#
+#   objects = tnm.run(filenames, 'Events', book, process, columns='Jet_pt')
+#
+# Note: book and process must be functions defined at module level.
+def run(filenames, treename, book, process, workers=4,
+        columns=None, batchsize=0, nrows=None):
+    from multiprocessing import Pool
+
+    if type(filenames) == type(""):
+        filenames = filenames.split()
+
+    # get number of entries to be read. Creating an Ntuple here also
+    # compiles, or loads, its buffer structs before the workers are
+    # forked, so that they need not do so (see bufferstructs).
+    ntuple  = Ntuple(filenames, treename, nrows, columns=columns)
+    entries = ntuple.entries
+    del ntuple
+
+    # partition entries among workers
+    workers = max(1, min(workers, entries))
+    step = (entries + workers - 1) // workers
+    jobs = []
+    for ii in range(workers):
+        start = ii * step
+        stop  = min(start + step, entries)
+        if start >= stop: break
+        jobs.append((filenames, treename, book, process,
+                     columns, batchsize, start, stop))
+
+    if len(jobs) > 1:
+        pool = Pool(len(jobs))
+        results = pool.map(runworker, jobs)
+        pool.close()
+        pool.join()
+    else:
+        # run in this process, so restore the histogram directory setting
+        adddirectory = ROOT.TH1.AddDirectoryStatus()
+        try:
+            if len(jobs) == 0:
+                # nothing to read: return the empty objects
+                ROOT.TH1.AddDirectory(False)
+                return book()
+            results = [runworker(x) for x in jobs]
+        finally:
+            ROOT.TH1.AddDirectory(adddirectory)
+
+    # re-raise the first error of a worker, once all have finished
+    failed = [x for x in results if x[0] is None]
+    if len(failed) > 0:
+        for rootfile, names, others in results:
+            if rootfile is not None: os.remove(rootfile)
+        exited, message = failed[0][1:]
+        if exited:
+            raise SystemExit(message)
+        raise RuntimeError("** run *** worker failed\n%s" % message)
+
+    return mergeresults(results)
+
+# Errors, including calls to sys.exit, are returned rather than raised, so
+# that a failed worker does not stop the pool: (None, exited, message).
+def runworker(job):
+    import traceback
+    try:
+        return _runworker(job)
+    except SystemExit as e:
+        return (None, True, e.code)
+    except Exception:
+        return (None, False, traceback.format_exc())
+
+def _runworker(job):
+    filenames, treename, book, process, columns, batchsize, start, stop = job
+
+    import tempfile, pickle
+    ROOT.TH1.AddDirectory(False)
+
+    objects = book()
+    ntuple  = Ntuple(filenames, treename, columns=columns)
+    if batchsize > 0:
+        # the variables of the Ntuple are those selected by columns
+        for batch in ntuple.batches(batchsize, None, start, stop):
+            process(batch, objects)
+    else:
+        for row in range(start, stop):
+            ntuple.read(row)
+            process(ntuple.event, objects)
+
+    # write ROOT objects to a file; return everything else as is
+    fd, rootfile = tempfile.mkstemp(suffix='.root', prefix='tnmrun_')
+    os.close(fd)
+    hfile = ROOT.TFile(rootfile, 'RECREATE')
+    others = {}
+    names  = []
+    for name, obj in objects.items():
+        if isinstance(obj, ROOT.TObject):
+            obj.Write(name)
+            names.append(name)
+        else:
+            others[name] = obj
+    hfile.Close()
+    return (rootfile, names, others)
+
+def mergeresults(results):
+    objects = {}
+    for rootfile, names, others in results:
+        hfile = ROOT.TFile(rootfile)
+        for name in names:
+            obj = hfile.Get(name)
+            if name in objects:
+                merge = ROOT.TList()
+                merge.Add(obj)
+                objects[name].Merge(merge)
+            else:
+                obj = obj.Clone()
+                if hasattr(obj, 'SetDirectory'):
+                    obj.SetDirectory(0)
+                objects[name] = obj
+        hfile.Close()
+        os.remove(rootfile)
+
+        for name, value in others.items():
+            if not name in objects:
+                objects[name] = value
+            elif isinstance(value, dict):
+                for key, x in value.items():
+                    objects[name][key] = objects[name].get(key, 0) + x
+            else:
+                objects[name] = objects[name] + value
+    return objects
+#------------------------------------------------------------------------------
 class Node:
     def __init__(self,
                  left, right, selector, cutValue,